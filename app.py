@@ -1,16 +1,33 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template_string, request
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import os
-import random
+import gzip
+import hashlib
+import hmac
+import json
+import queue
 import sqlite3
+import threading
+import time
 from datetime import datetime
-from ua_generator import UserAgentGenerator
+from ua_generator import EXPORT_COLUMNS, UserAgentGenerator, score_histogram, score_user_agent
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
 
+# Database locations and limiter switch (overridable for scratch/load-test runs)
+UA_DB_PATH = os.environ.get('UA_DB_PATH', 'useragents.db')
+ANALYTICS_DB_PATH = os.environ.get('ANALYTICS_DB_PATH', 'analytics.db')
+app.config['RATELIMIT_ENABLED'] = os.environ.get('UA_RATELIMIT_ENABLED', '1') != '0'
+
 # Initialize rate limiter
 limiter = Limiter(
     get_remote_address,
@@ -20,11 +37,25 @@ limiter = Limiter(
 )
 
 # Initialize the UA generator
-generator = UserAgentGenerator()
+# (UA_SEED makes the per-thread random streams reproducible, e.g. for load tests)
+generator = UserAgentGenerator(UA_DB_PATH, seed=os.environ.get('UA_SEED'))
+if os.environ.get('UA_PROFILES_PATH'):
+    generator.load_profiles(os.environ['UA_PROFILES_PATH'])
+
+# Profiles from the bundled file and UA_PROFILES_PATH cannot be replaced over the API
+CONFIG_PROFILES = frozenset(generator.profiles)
+
+# PUT /api/profiles/<name> is disabled unless UA_ADMIN_TOKEN is set, and capped in count
+UA_ADMIN_TOKEN = os.environ.get('UA_ADMIN_TOKEN')
+MAX_PROFILES = int(os.environ.get('UA_MAX_PROFILES', 64))
+
+def connect_analytics():
+    """Open a connection to the analytics database"""
+    return metrics.attach(sqlite3.connect(ANALYTICS_DB_PATH))
 
 def init_analytics_db():
     """Initialize analytics database"""
-    conn = sqlite3.connect('analytics.db')
+    conn = connect_analytics()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -60,10 +91,97 @@ def init_analytics_db():
 # Initialize analytics database
 init_analytics_db()
 
+def retention_worker(days, archive_path, interval):
+    """Periodically archive generated user agents older than the retention window"""
+    while True:
+        try:
+            generator.archive_generated_agents(days, archive_path)
+        except Exception as e:
+            app.logger.error(f"Retention run failed: {e}")
+        time.sleep(interval)
+
+# Retention for generated_agents is opt-in: UA_RETENTION_DAYS, UA_ARCHIVE_PATH, UA_RETENTION_INTERVAL
+if os.environ.get('UA_RETENTION_DAYS'):
+    threading.Thread(
+        target=retention_worker,
+        args=(
+            int(os.environ['UA_RETENTION_DAYS']),
+            os.environ.get('UA_ARCHIVE_PATH'),
+            int(os.environ.get('UA_RETENTION_INTERVAL', 3600))
+        ),
+        daemon=True
+    ).start()
+
+class PrecompressedPage:
+    """A template rendered once and kept in identity, gzip and brotli encodings."""
+    
+    def __init__(self, template_name):
+        self.path = os.path.join(app.root_path, app.template_folder, template_name)
+        self.mtime = None
+        self.checked_at = 0
+        self.variants = {}
+        self.lock = threading.Lock()
+        self.refresh()
+    
+    def refresh(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self.mtime:
+            return
+        
+        with open(self.path, encoding='utf-8') as f:
+            source = f.read()
+        with app.app_context():
+            body = render_template_string(source).encode('utf-8')
+        
+        tag = hashlib.sha256(body).hexdigest()[:20]
+        variants = {
+            'identity': (body, tag),
+            'gzip': (gzip.compress(body, compresslevel=9), f"{tag}-gz")
+        }
+        if brotli is not None:
+            variants['br'] = (brotli.compress(body, quality=11), f"{tag}-br")
+        
+        # Swap both together so readers never see a mixed state
+        self.variants, self.mtime = variants, mtime
+    
+    def variant(self, accept_encodings):
+        """Return (encoding, body, etag) for the best encoding the client accepts"""
+        now = time.monotonic()
+        if now - self.checked_at >= 1:
+            with self.lock:
+                if now - self.checked_at >= 1:
+                    self.checked_at = now
+                    self.refresh()
+        
+        variants = self.variants
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and accept_encodings[encoding]:
+                return (encoding,) + variants[encoding]
+        return ('identity',) + variants['identity']
+
+index_page = PrecompressedPage('index.html')
+
+# Browsers revalidate the page with its ETag (cheap 304) unless a max-age is configured
+INDEX_CACHE_CONTROL = (
+    f"public, max-age={os.environ['INDEX_MAX_AGE']}" if os.environ.get('INDEX_MAX_AGE') else 'public, no-cache'
+)
+
 @app.route('/')
 def index():
-    """Render the main page"""
-    return render_template('index.html')
+    """Serve the main page from its precompressed variants"""
+    encoding, body, etag = index_page.variant(request.accept_encodings)
+    
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = INDEX_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 @app.route('/api/generate', methods=['POST'])
 @limiter.limit("10 per minute")
@@ -72,40 +190,88 @@ def generate_ua():
     try:
         data = request.get_json()
         device_type = data.get('device_type', 'both')
+        if device_type not in ('android', 'ios', 'both'):
+            return jsonify({'error': "device_type must be 'android', 'ios' or 'both'"}), 400
+        with_headers = bool(data.get('headers'))
+        profile = data.get('profile')
+        if profile is not None:
+            # Only named profiles: inline definitions would let clients churn the compile cache
+            if not isinstance(profile, str) or profile not in generator.profiles:
+                return jsonify({'error': f"Unknown profile (choose from {', '.join(generator.profiles)})"}), 400
+        filters = data.get('filters')
+        if profile is not None or filters:
+            try:
+                generator.profile_sampler(profile, filters).check_device_type(device_type)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Generate user agent until we get one with high entropy
         max_attempts = 5
         attempts = 0
         while attempts < max_attempts:
-            if device_type == 'android':
-                ua = generator.generate_android_ua()
-            elif device_type == 'ios':
-                ua = generator.generate_ios_ua()
+            if with_headers:
+                record = generator.generate_record(device_type, profile, filters)
+                ua = record['user_agent']
             else:
-                ua = generator.generate_android_ua() if random.random() < 0.5 else generator.generate_ios_ua()
+                ua = generator.generate_ua(device_type, profile, filters)
             
             entropy_score = generator.calculate_entropy_score(ua)
             if entropy_score >= 90:
                 break
             attempts += 1
         
+        metrics.observe('generate_attempts', min(attempts + 1, max_attempts), buckets=(1, 2, 3, 4, 5))
+        
         # Save the generated UA
         generator.save_generated_ua(ua, 'android' if 'Android' in ua else 'ios')
         
-        return jsonify({
+        response = {
             'user_agent': ua,
             'entropy_score': entropy_score,
             'device_type': 'android' if 'Android' in ua else 'ios'
+        }
+        if with_headers:
+            response['headers'] = record['headers']
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Largest batch accepted by /api/score in one call
+MAX_SCORE_BATCH = 10000
+
+@app.route('/api/score', methods=['POST'])
+@limiter.limit("30 per minute")
+def score_uas():
+    """Score a JSON array of user agents"""
+    try:
+        user_agents = request.get_json()
+        if not isinstance(user_agents, list) or not all(isinstance(ua, str) for ua in user_agents):
+            return jsonify({'error': 'Expected a JSON array of user agent strings'}), 400
+        if len(user_agents) > MAX_SCORE_BATCH:
+            return jsonify({'error': f'At most {MAX_SCORE_BATCH} user agents per request'}), 413
+        
+        scores = [score_user_agent(ua) for ua in user_agents]
+        
+        return jsonify({
+            'scores': scores,
+            'count': len(scores),
+            'mean': round(sum(scores) / len(scores), 1) if scores else 0,
+            'histogram': score_histogram(scores)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+@limiter.exempt
+def get_metrics():
+    """Expose hot-path timers and counters in Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/stats')
 def get_stats():
     """Get generation statistics"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(generator.db_path)
+        conn = generator.connect()
         cursor = conn.cursor()
         
         stats = cursor.execute("""
@@ -123,23 +289,222 @@ def get_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Page size bounds for /api/agents
+DEFAULT_AGENTS_PAGE = 1000
+MAX_AGENTS_PAGE = 10000
+
+@app.route('/api/agents')
+@limiter.limit("600 per minute")
+def list_agents():
+    """Page through stored user agents by id (keyset pagination)"""
+    try:
+        try:
+            # Not type=int: that turns a mangled cursor into 0 and silently restarts the sync
+            after_id = int(request.args.get('after_id', 0))
+            limit = int(request.args.get('limit', DEFAULT_AGENTS_PAGE))
+        except ValueError:
+            return jsonify({'error': 'after_id and limit must be integers'}), 400
+        device_type = request.args.get('device_type')
+        if after_id < 0 or not 1 <= limit <= MAX_AGENTS_PAGE:
+            return jsonify({'error': f'after_id must be >= 0 and limit between 1 and {MAX_AGENTS_PAGE}'}), 400
+        if device_type not in (None, 'android', 'ios'):
+            return jsonify({'error': "device_type must be 'android' or 'ios'"}), 400
+        
+        rows = generator.agents_page(after_id, limit, device_type)
+        next_after_id = rows[-1][0] if rows else after_id
+        has_more = len(rows) == limit
+        
+        fmt = request.args.get('format')
+        if fmt == 'ndjson' or (fmt is None and request.accept_mimetypes.best == 'application/x-ndjson'):
+            body = ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')) + '\n' for row in rows)
+            response = Response(body, mimetype='application/x-ndjson')
+            response.headers['X-Next-After-Id'] = str(next_after_id)
+            response.headers['X-Has-More'] = 'true' if has_more else 'false'
+            return response
+        
+        return jsonify({
+            'agents': [dict(zip(EXPORT_COLUMNS, row)) for row in rows],
+            'next_after_id': next_after_id,
+            'has_more': has_more
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/profiles')
+def list_profiles():
+    """List the named weight profiles"""
+    return jsonify({'profiles': generator.profiles})
+
+@app.route('/api/profiles/<name>', methods=['PUT'])
+@limiter.limit("10 per minute")
+def put_profile(name):
+    """Define or replace a named weight profile (admin only)"""
+    if not UA_ADMIN_TOKEN:
+        return jsonify({'error': 'Profile editing is disabled (set UA_ADMIN_TOKEN)'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {UA_ADMIN_TOKEN}'):
+        return jsonify({'error': 'Admin token required'}), 401
+    if name in CONFIG_PROFILES:
+        return jsonify({'error': f"Profile '{name}' is defined in configuration and cannot be replaced"}), 403
+    if name not in generator.profiles and len(generator.profiles) >= MAX_PROFILES:
+        return jsonify({'error': f'At most {MAX_PROFILES} profiles can be defined'}), 400
+    try:
+        generator.register_profile(name, request.get_json(force=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'name': name, 'profile': generator.profiles[name]})
+
+# Largest count accepted by /api/random
+MAX_RANDOM_COUNT = 100
+
+@app.route('/api/random')
+@limiter.limit("60 per minute")
+def random_agents():
+    """Return user agents drawn uniformly from the stored corpus"""
+    try:
+        count = request.args.get('count', 1, type=int)
+        device_type = request.args.get('device_type')
+        if not 1 <= count <= MAX_RANDOM_COUNT:
+            return jsonify({'error': f'count must be between 1 and {MAX_RANDOM_COUNT}'}), 400
+        if device_type not in (None, 'android', 'ios'):
+            return jsonify({'error': "device_type must be 'android' or 'ios'"}), 400
+        
+        rows = generator.random_agents(count, device_type)
+        if not rows:
+            return jsonify({'error': 'No stored user agents match'}), 404
+        return jsonify({'agents': [dict(zip(EXPORT_COLUMNS, row)) for row in rows]})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+class AgentBroadcaster:
+    """Fans rows saved by the generator out to /api/agents/stream subscribers."""
+    
+    def __init__(self, queue_size=1000, max_subscribers=100):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+    
+    def subscribe(self):
+        """Return a new subscriber queue, or None when at capacity"""
+        subscriber = queue.Queue(self.queue_size)
+        subscriber.overflowed = False
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+    
+    def publish(self, rows):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber.overflowed:
+                continue
+            try:
+                for row in rows:
+                    subscriber.put_nowait(row)
+            except queue.Full:
+                subscriber.overflowed = True
+
+# Each stream holds a server thread: keep the cap below the worker's thread count
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('UA_STREAM_MAX_SUBSCRIBERS', 4))
+
+broadcaster = AgentBroadcaster(max_subscribers=STREAM_MAX_SUBSCRIBERS)
+generator.add_listener(broadcaster.publish)
+
+# Seconds between SSE keep-alive comments on an idle stream, and the client reconnect delay
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MS = 3000
+
+# Seconds a stream stays open before the client has to reconnect (resuming via Last-Event-ID)
+STREAM_MAX_AGE = int(os.environ.get('UA_STREAM_MAX_AGE', 300))
+
+def format_agent_event(row):
+    return f"id: {row[0]}\nevent: agent\ndata: {json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':'))}\n\n"
+
+@app.route('/api/agents/stream')
+@limiter.limit("30 per minute")
+def stream_agents():
+    """Server-Sent Events feed of newly saved user agents"""
+    last_id = request.headers.get('Last-Event-ID', request.args.get('after_id'))
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer row id'}), 400
+    device_type = request.args.get('device_type')
+    if device_type not in (None, 'android', 'ios'):
+        return jsonify({'error': "device_type must be 'android' or 'ios'"}), 400
+    
+    # Subscribe before replaying so no row saved in between is missed
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        return jsonify({'error': 'Too many stream subscribers, try again later'}), 503
+    
+    def events():
+        nonlocal last_id
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            if last_id is not None:
+                while True:
+                    rows = generator.agents_page(last_id, MAX_AGENTS_PAGE, device_type)
+                    for row in rows:
+                        yield format_agent_event(row)
+                    if rows:
+                        last_id = rows[-1][0]
+                    if len(rows) < MAX_AGENTS_PAGE:
+                        break
+            
+            while True:
+                if subscriber.overflowed and subscriber.empty():
+                    # Everything queued before the overflow is out: make the client resume
+                    yield "event: overflow\ndata: reconnect with Last-Event-ID\n\n"
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Free the thread; EventSource reconnects and resumes from Last-Event-ID
+                    return
+                try:
+                    row = subscriber.get(timeout=min(STREAM_KEEPALIVE, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if last_id is not None and row[0] <= last_id:
+                    continue
+                if device_type and row[2] != device_type:
+                    continue
+                last_id = row[0]
+                yield format_agent_event(row)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/track-visit', methods=['POST'])
 def track_visit():
     """Track page visits"""
     try:
-        conn = sqlite3.connect('analytics.db')
+        conn = connect_analytics()
         cursor = conn.cursor()
         
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
         user_agent = request.headers.get('User-Agent', 'unknown')
         referer = request.headers.get('Referer', 'direct')
         
-        cursor.execute(
-            "INSERT INTO page_views (ip_address, user_agent, referer) VALUES (?, ?, ?)",
-            (ip_address, user_agent, referer)
-        )
-        
-        conn.commit()
+        with metrics.timer('analytics_insert'):
+            cursor.execute(
+                "INSERT INTO page_views (ip_address, user_agent, referer) VALUES (?, ?, ?)",
+                (ip_address, user_agent, referer)
+            )
+            
+            conn.commit()
         conn.close()
         
         return jsonify({'status': 'success'})
@@ -153,17 +518,18 @@ def track_generation():
         data = request.get_json()
         device_type = data.get('device_type', 'unknown')
         
-        conn = sqlite3.connect('analytics.db')
+        conn = connect_analytics()
         cursor = conn.cursor()
         
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
         
-        cursor.execute(
-            "INSERT INTO generations (device_type, ip_address) VALUES (?, ?)",
-            (device_type, ip_address)
-        )
-        
-        conn.commit()
+        with metrics.timer('analytics_insert'):
+            cursor.execute(
+                "INSERT INTO generations (device_type, ip_address) VALUES (?, ?)",
+                (device_type, ip_address)
+            )
+            
+            conn.commit()
         conn.close()
         
         return jsonify({'status': 'success'})
@@ -174,28 +540,86 @@ def track_generation():
 def track_copy():
     """Track copy actions"""
     try:
-        conn = sqlite3.connect('analytics.db')
+        conn = connect_analytics()
         cursor = conn.cursor()
         
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
         
-        cursor.execute(
-            "INSERT INTO copy_actions (ip_address) VALUES (?)",
-            (ip_address,)
-        )
-        
-        conn.commit()
+        with metrics.timer('analytics_insert'):
+            cursor.execute(
+                "INSERT INTO copy_actions (ip_address) VALUES (?)",
+                (ip_address,)
+            )
+            
+            conn.commit()
         conn.close()
         
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Largest batch accepted by /api/events in one call
+MAX_EVENTS_PER_BATCH = 200
+
+@app.route('/api/events', methods=['POST'])
+def track_events():
+    """Record a batch of analytics events (visit, generation, copy) in one transaction"""
+    try:
+        # sendBeacon posts a plain-text body, so parse regardless of content type
+        events = request.get_json(force=True, silent=True)
+        if isinstance(events, dict):
+            events = events.get('events')
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return jsonify({'error': 'Expected a JSON array of events'}), 400
+        if len(events) > MAX_EVENTS_PER_BATCH:
+            return jsonify({'error': f'At most {MAX_EVENTS_PER_BATCH} events per request'}), 413
+        
+        ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
+        user_agent = request.headers.get('User-Agent', 'unknown')
+        referer = request.headers.get('Referer', 'direct')
+        
+        visits, generations, copies = [], [], []
+        for event in events:
+            event_type = event.get('type')
+            if event_type == 'visit':
+                visits.append((ip_address, user_agent, referer))
+            elif event_type == 'generation':
+                generations.append((str(event.get('device_type', 'unknown')), ip_address))
+            elif event_type == 'copy':
+                copies.append((ip_address,))
+            else:
+                return jsonify({'error': f'Unknown event type: {event_type}'}), 400
+        
+        conn = connect_analytics()
+        try:
+            with metrics.timer('analytics_insert'), conn:
+                if visits:
+                    conn.executemany(
+                        "INSERT INTO page_views (ip_address, user_agent, referer) VALUES (?, ?, ?)",
+                        visits
+                    )
+                if generations:
+                    conn.executemany(
+                        "INSERT INTO generations (device_type, ip_address) VALUES (?, ?)",
+                        generations
+                    )
+                if copies:
+                    conn.executemany(
+                        "INSERT INTO copy_actions (ip_address) VALUES (?)",
+                        copies
+                    )
+        finally:
+            conn.close()
+        
+        return jsonify({'status': 'success', 'recorded': len(events)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/analytics')
 def get_analytics():
     """Get analytics data"""
     try:
-        conn = sqlite3.connect('analytics.db')
+        conn = connect_analytics()
         cursor = conn.cursor()
         
         # Get total page views
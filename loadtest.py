@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Local load-testing harness for the Flask service.
+
+Starts app.py (under gunicorn or the threaded Werkzeug server) against scratch
+databases, drives it with concurrent keep-alive clients issuing a weighted mix
+of requests, and reports throughput, latency percentiles and error rates per
+route. Everything runs offline on one machine.
+"""
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import click
+
+from ua_generator import ua_hash
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (method, path, body factory)
+ROUTES = {
+    'index': ('GET', '/', None),
+    'generate': ('POST', '/api/generate', lambda rng: {'device_type': rng.choice(['android', 'ios', 'both'])}),
+    'stats': ('GET', '/api/stats', None),
+    'track-visit': ('POST', '/api/track-visit', lambda rng: {}),
+    'track-generation': ('POST', '/api/track-generation', lambda rng: {'device_type': rng.choice(['android', 'ios'])}),
+    'track-copy': ('POST', '/api/track-copy', lambda rng: {}),
+    'analytics': ('GET', '/api/analytics', None),
+    'events': ('POST', '/api/events', lambda rng: [
+        rng.choice([{'type': 'visit'}, {'type': 'generation', 'device_type': 'ios'}, {'type': 'copy'}])
+        for _ in range(rng.randint(1, 20))
+    ]),
+}
+
+DEFAULT_MIX = 'generate=4,stats=2,track-visit=1,track-generation=4,track-copy=2,analytics=1'
+
+
+def parse_mix(mix):
+    """Parse 'route=weight,...' into a {route: weight} dict"""
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ROUTES:
+            raise click.BadParameter(f"Unknown route '{name}' (choose from {', '.join(ROUTES)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server, port, workers, threads, env, log):
+    """Launch the app in a subprocess and return the Popen handle"""
+    if server == 'gunicorn':
+        command = [
+            sys.executable, '-m', 'gunicorn', 'wsgi:app',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers),
+            '--threads', str(threads),
+            '--timeout', '0',
+            '--log-level', 'warning'
+        ]
+    else:
+        command = [
+            sys.executable, '-c',
+            f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"
+        ]
+    return subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(host, port, process, log_path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            with open(log_path, errors='replace') as f:
+                raise click.ClickException(f"Server exited early:\n{f.read()}")
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/api/stats')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise click.ClickException("Server did not become ready in time")
+
+
+def prefill(db_dir, analytics_rows, agent_rows):
+    """Grow the scratch tables so table-size effects show up in the run"""
+    now = datetime.now().isoformat()
+    if analytics_rows:
+        conn = sqlite3.connect(os.path.join(db_dir, 'analytics.db'))
+        with conn:
+            conn.executemany(
+                "INSERT INTO page_views (ip_address, user_agent, referer) VALUES (?, ?, ?)",
+                ((f"10.0.{i % 256}.{i // 256 % 256}", 'loadtest', 'direct') for i in range(analytics_rows))
+            )
+            conn.executemany(
+                "INSERT INTO generations (device_type, ip_address) VALUES (?, ?)",
+                (('android' if i % 2 else 'ios', f"10.0.{i % 256}.1") for i in range(analytics_rows))
+            )
+            conn.executemany(
+                "INSERT INTO copy_actions (ip_address) VALUES (?)",
+                ((f"10.0.{i % 256}.1",) for i in range(analytics_rows))
+            )
+        conn.close()
+    if agent_rows:
+        conn = sqlite3.connect(os.path.join(db_dir, 'useragents.db'))
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO generated_agents (ua_hash, user_agent, device_type, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                ((ua_hash(f"loadtest-agent-{i}"), f"loadtest-agent-{i}", 'android' if i % 2 else 'ios', now)
+                 for i in range(agent_rows))
+            )
+        conn.close()
+
+
+class Recorder:
+    """Collects (latency, status) samples per route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, latency, status):
+        with self.lock:
+            self.latencies[route].append(latency)
+            self.statuses[route][status] += 1
+
+
+def client_loop(host, port, routes, weights, recorder, stop_at, remaining, seed):
+    """One simulated client reusing a keep-alive connection"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.monotonic() < stop_at:
+        if remaining is not None:
+            with remaining['lock']:
+                if remaining['count'] <= 0:
+                    break
+                remaining['count'] -= 1
+
+        route = rng.choices(routes, weights=weights)[0]
+        method, path, body_factory = ROUTES[route]
+        body = json.dumps(body_factory(rng)) if body_factory else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException) as e:
+            status = type(e).__name__
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+        recorder.record(route, time.perf_counter() - started, status)
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def report(recorder, elapsed):
+    click.echo(f"\n{'route':<18}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}"
+               f"{'p99 ms':>9}{'max ms':>9}{'429':>7}{'errors':>8}")
+    total = 0
+    for route in sorted(recorder.latencies):
+        latencies = sorted(recorder.latencies[route])
+        statuses = recorder.statuses[route]
+        limited = statuses.get(429, 0)
+        errors = sum(n for status, n in statuses.items()
+                     if status != 429 and (not isinstance(status, int) or status >= 400))
+        total += len(latencies)
+        click.echo(
+            f"{route:<18}{len(latencies):>9}{len(latencies) / elapsed:>9.1f}"
+            f"{percentile(latencies, 0.5) * 1000:>9.1f}{percentile(latencies, 0.9) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>9.1f}{latencies[-1] * 1000:>9.1f}"
+            f"{limited:>7}{errors / len(latencies) * 100:>7.1f}%"
+        )
+    click.echo(f"\nTotal: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+
+
+@click.command()
+@click.option('--url', help='Target an already running server (host:port) instead of starting one')
+@click.option('--server', type=click.Choice(['gunicorn', 'werkzeug']), default='gunicorn',
+              help='Server used to host the app')
+@click.option('--workers', default=1, help='gunicorn worker processes')
+@click.option('--threads', default=8, help='gunicorn threads per worker')
+@click.option('--clients', '-c', default=16, help='Concurrent clients')
+@click.option('--duration', '-t', default=30.0, help='Run time in seconds')
+@click.option('--requests', '-n', type=int, help='Stop after this many requests in total')
+@click.option('--mix', default=DEFAULT_MIX, show_default=True, help='Weighted route mix')
+@click.option('--limit/--no-limit', default=False, help='Keep the rate limiter on (off measures capacity)')
+@click.option('--prefill-analytics', default=0, help='Rows inserted into each analytics table before the run')
+@click.option('--prefill-agents', default=0, help='Rows inserted into generated_agents before the run')
+@click.option('--keep-db', is_flag=True, help='Keep the scratch database directory')
+@click.option('--seed', default=0, help='Seed for the traffic mix')
+@click.option('--server-seed', help='UA_SEED for the app (reproducible per-thread generator streams)')
+def main(url, server, workers, threads, clients, duration, requests, mix, limit,
+         prefill_analytics, prefill_agents, keep_db, seed, server_seed):
+    """Load-test the user agent service"""
+    weights = parse_mix(mix)
+    process = None
+    db_dir = None
+    log_path = None
+
+    if url:
+        host, _, port = url.rpartition(':')
+        port = int(port)
+    else:
+        host, port = '127.0.0.1', free_port()
+        db_dir = tempfile.mkdtemp(prefix='ua-loadtest-')
+        env = dict(
+            os.environ,
+            UA_DB_PATH=os.path.join(db_dir, 'useragents.db'),
+            ANALYTICS_DB_PATH=os.path.join(db_dir, 'analytics.db'),
+            UA_RATELIMIT_ENABLED='1' if limit else '0'
+        )
+        if server_seed is not None:
+            env['UA_SEED'] = server_seed
+        log_path = os.path.join(db_dir, 'server.log')
+        click.echo(f"Starting {server} on {host}:{port} (workers={workers}, threads={threads}, db={db_dir})")
+        with open(log_path, 'wb') as log:
+            process = start_server(server, port, workers, threads, env, log)
+
+    try:
+        wait_until_ready(host, port, process, log_path)
+        if db_dir:
+            prefill(db_dir, prefill_analytics, prefill_agents)
+
+        click.echo(f"Running {clients} clients for {duration}s" + (f" / {requests} requests" if requests else ""))
+        recorder = Recorder()
+        remaining = {'lock': threading.Lock(), 'count': requests} if requests else None
+        routes = list(weights)
+        started = time.monotonic()
+        client_threads = [
+            threading.Thread(
+                target=client_loop,
+                args=(host, port, routes, [weights[r] for r in routes], recorder,
+                      started + duration, remaining, seed * 1000 + i),
+                daemon=True
+            )
+            for i in range(clients)
+        ]
+        for thread in client_threads:
+            thread.start()
+        for thread in client_threads:
+            thread.join()
+        report(recorder, time.monotonic() - started)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if db_dir and not keep_db:
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Low-overhead timers and counters for the generation hot path.
+
+Instrumentation is off unless UA_METRICS=1 is set or enable() is called. While
+off, timer() hands back a shared no-op context manager and the other helpers
+return immediately, so instrumented code pays roughly one function call.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+enabled = os.environ.get('UA_METRICS') == '1'
+
+# Upper bounds (seconds) for stage timing histograms
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _StageTimer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe('stage_seconds', time.perf_counter() - self.start, stage=self.stage)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable():
+    """Turn instrumentation on for this process"""
+    global enabled
+    enabled = True
+
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def timer(stage):
+    """Context manager timing one execution of a named stage"""
+    if not enabled:
+        return _NULL_TIMER
+    return _StageTimer(stage)
+
+
+def count(name, value=1, **labels):
+    """Increment a counter"""
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    """Record a value in a histogram"""
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def trace_sql(statement):
+    """sqlite3 trace callback counting executed statements by verb"""
+    code = ' '.join(line for line in statement.splitlines() if not line.lstrip().startswith('--'))
+    words = code.split(None, 1)
+    count('sqlite_statements', verb=words[0].upper() if words else '')
+
+
+def attach(conn):
+    """Install the statement trace callback on a connection when enabled"""
+    if enabled:
+        conn.set_trace_callback(trace_sql)
+    return conn
+
+
+def stage_summary():
+    """Return {stage: (count, total_seconds)} for all timed stages"""
+    with _lock:
+        return {
+            dict(labels)['stage']: (histogram.count, histogram.sum)
+            for (name, labels), histogram in _histograms.items()
+            if name == 'stage_seconds'
+        }
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    if not enabled:
+        lines.append('# instrumentation disabled; set UA_METRICS=1 to enable')
+
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f'ua_{name}_total'
+            if metric not in seen:
+                lines.append(f'# TYPE {metric} counter')
+                seen.add(metric)
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+
+        for (name, labels), histogram in histograms:
+            metric = f'ua_{name}'
+            if metric not in seen:
+                lines.append(f'# TYPE {metric} histogram')
+                seen.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {histogram.count}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {histogram.count}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+import ua_generator
+from ua_generator import UserAgentGenerator
+
+LEGACY_ROWS = 50
+
+
+def make_legacy_db(path):
+    """A database with the generated_agents schema from before ua_hash"""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE generated_agents (
+            id INTEGER PRIMARY KEY,
+            user_agent TEXT UNIQUE,
+            device_type TEXT,
+            created_at TIMESTAMP
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO generated_agents (user_agent, device_type, created_at) VALUES (?, ?, ?)",
+        ((f"agent {i}", 'android', '2024-01-01T00:00:00') for i in range(LEGACY_ROWS))
+    )
+    conn.commit()
+    conn.close()
+
+
+def table_rows(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT id, user_agent FROM {table} ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_startup_refuses_an_old_schema(tmp_path):
+    path = str(tmp_path / 'ua.db')
+    make_legacy_db(path)
+    with pytest.raises(RuntimeError, match='migrate'):
+        UserAgentGenerator(path)
+    assert len(table_rows(path, 'generated_agents')) == LEGACY_ROWS
+
+
+def test_interrupted_migration_rolls_back_and_can_be_rerun(tmp_path, monkeypatch):
+    path = str(tmp_path / 'ua.db')
+    make_legacy_db(path)
+    before = table_rows(path, 'generated_agents')
+    calls = []
+    real_hash = ua_generator.ua_hash
+
+    def failing_hash(ua):
+        # Dies halfway through the copy
+        calls.append(ua)
+        if len(calls) > LEGACY_ROWS // 2:
+            raise ValueError("interrupted")
+        return real_hash(ua)
+
+    monkeypatch.setattr(ua_generator, 'ua_hash', failing_hash)
+    with pytest.raises(sqlite3.OperationalError):
+        UserAgentGenerator.migrate_database(path)
+    monkeypatch.undo()
+
+    # Nothing half-done is left: the old table and its rows are untouched
+    assert table_rows(path, 'generated_agents') == before
+    with pytest.raises(RuntimeError):
+        UserAgentGenerator(path)
+
+    assert UserAgentGenerator.migrate_database(path)
+    assert table_rows(path, 'generated_agents') == before
+    assert not UserAgentGenerator.migrate_database(path)
+    UserAgentGenerator(path).save_generated_ua('agent 0', 'android')
+    assert len(table_rows(path, 'generated_agents')) == LEGACY_ROWS
+
+
+def test_migration_finishes_a_rebuild_left_halfway(tmp_path):
+    path = str(tmp_path / 'ua.db')
+    make_legacy_db(path)
+    before = table_rows(path, 'generated_agents')
+    # An older, non-transactional rebuild stopped after the rename and part of the copy
+    conn = sqlite3.connect(path)
+    conn.execute("ALTER TABLE generated_agents RENAME TO generated_agents_old")
+    conn.execute("""
+        CREATE TABLE generated_agents (
+            id INTEGER PRIMARY KEY,
+            ua_hash INTEGER NOT NULL,
+            user_agent TEXT,
+            device_type TEXT,
+            created_at TIMESTAMP
+        )
+    """)
+    conn.create_function('ua_hash', 1, ua_generator.ua_hash)
+    conn.execute("INSERT INTO generated_agents SELECT id, ua_hash(user_agent), user_agent, device_type, created_at "
+                 "FROM generated_agents_old WHERE id <= 10")
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(RuntimeError):
+        UserAgentGenerator(path)
+    assert UserAgentGenerator.migrate_database(path)
+    assert table_rows(path, 'generated_agents') == before
+    UserAgentGenerator(path)
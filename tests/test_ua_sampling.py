@@ -0,0 +1,73 @@
+from collections import Counter
+
+import pytest
+
+from ua_generator import UserAgentGenerator
+from ua_sampling import ANDROID_UA_PATTERN, IOS_UA_PATTERN, DiskDedup, QuotaSchedule
+
+
+def pattern(ua):
+    """Template class of a user agent: build tag and extra tag, or iOS pattern and app"""
+    match = ANDROID_UA_PATTERN.fullmatch(ua)
+    if match:
+        tag, extra = match.group(2), match.group(5)
+        template = 'none' if tag is None else 'wv' if tag == 'wv' else 'build' if tag.startswith('Build/') else 'bare'
+        return f"android:{template}{'+extra' if extra else ''}"
+    match = IOS_UA_PATTERN.fullmatch(ua)
+    if match.group(7):
+        return 'ios:crios' if match.group(7).startswith('CriOS/') else 'ios:app'
+    return 'ios:safari_device' if match.group(6) else 'ios:safari'
+
+
+def frequencies(uas):
+    counts = Counter(pattern(ua) for ua in uas)
+    return {key: count / len(uas) for key, count in counts.items()}
+
+
+@pytest.fixture(scope='module')
+def generator(tmp_path_factory):
+    return UserAgentGenerator(str(tmp_path_factory.mktemp('db') / 'ua.db'), seed=7)
+
+
+@pytest.mark.parametrize('device_type', ['android', 'ios', 'both'])
+def test_unique_patterns_match_generate_ua(generator, device_type):
+    space = generator.space
+    # Stay below the point where the smallest stratum runs out and its share moves to the others
+    count = min(2000, int(min(size / weight for _, _, size, weight in space.strata(device_type))))
+    unique = frequencies(list(space.iter_unique(count, device_type, seed=1)))
+    normal = frequencies([generator.generate_ua(device_type) for _ in range(20000)])
+    for key in set(unique) | set(normal):
+        assert unique.get(key, 0) == pytest.approx(normal.get(key, 0), abs=0.02), key
+
+
+def test_quota_schedule_covers_every_stratum_position_once():
+    counts = [5, 100, 0, 3]
+    schedule = QuotaSchedule(counts, [14, 4, 1, 1])
+    positions = sorted(schedule.locate(position) for position in range(schedule.size))
+    assert positions == [(stratum, i) for stratum, count in enumerate(counts) for i in range(count)]
+
+
+def test_unique_shards_stay_disjoint_and_resume(generator):
+    space = generator.space
+    first = list(space.iter_unique_indices(3000, 'both', seed=2, shard=(0, 3)))
+    second = list(space.iter_unique_indices(3000, 'both', seed=2, shard=(1, 3)))
+    assert len(set(first)) == 3000 and not set(first) & set(second)
+    assert list(space.iter_unique_indices(500, 'both', seed=2, start=2500, shard=(0, 3))) == first[2500:]
+    assert all(space.encode(space.render(index)) == index for index in first[:500])
+
+
+def test_disk_dedup_keeps_open_files_below_partition_count(tmp_path):
+    resource = pytest.importorskip('resource')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    items = [f"ua-{i % 30000}" for i in range(40000)]
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(64, hard), hard))
+    try:
+        with DiskDedup(len(items), 40 * DiskDedup.BYTES_PER_ITEM, tmp_path) as dedup:
+            assert dedup.partitions == DiskDedup.MAX_PARTITIONS
+            duplicates = []
+            for item in items:
+                dedup.add(item)
+            unique = list(dedup.drain(on_duplicate=duplicates.append))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert sorted(unique) == sorted(set(items)) and len(duplicates) == 10000
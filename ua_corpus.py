@@ -0,0 +1,185 @@
+"""Compact binary corpus files of user agents.
+
+Every user agent the generator produces is one index in a UserAgentSpace:
+catalog row numbers plus the random decorations (build ID, WebKit minor, app
+and Chrome iOS versions) packed as mixed-radix digits. A corpus stores each
+user agent as that index in a fixed number of bytes (6 with the bundled
+catalog) and embeds the space's dictionary in its header, so it decodes
+without the database and stays readable after the catalog changes.
+
+Layout (integers big-endian):
+
+    magic           8 bytes   b'UACORPUS'
+    version         uint16
+    record width    uint16    bytes per user agent
+    header length   uint32
+    count           uint64
+    header          JSON: android_devices, android_classes, chrome_versions,
+                    ios_platforms and the decoration tables the indices
+                    were built with
+    padding         to a multiple of 8 bytes
+    records         count x record width
+"""
+import json
+import mmap
+import struct
+
+import ua_sampling
+from ua_sampling import UserAgentSpace
+
+MAGIC = b'UACORPUS'
+VERSION = 3
+PREAMBLE = struct.Struct('>8sHHIQ')
+
+# Records buffered per write
+WRITE_BATCH = 65536
+
+
+def component_tables():
+    """The decoration tables UserAgentSpace indices depend on"""
+    tables = {}
+    for name in ('ANDROID_BUILD_PREFIXES', 'ANDROID_BUILD_LETTERS', 'ANDROID_WEBKIT_MINORS', 'ANDROID_EXTRA_TAGS',
+                 'IOS_MOBILE_VERSIONS', 'IOS_WEBKIT_VERSIONS', 'IOS_APPS'):
+        tables[name.lower()] = list(getattr(ua_sampling, name))
+    for name in ('IOS_APP_MAJORS', 'IOS_APP_MINORS', 'IOS_CRIOS_MAJORS', 'IOS_CRIOS_BUILDS', 'IOS_CRIOS_PATCHES'):
+        values = getattr(ua_sampling, name)
+        tables[name.lower()] = [values.start, values.stop]
+    tables['android_build_numbers'] = ua_sampling.ANDROID_BUILD_NUMBERS
+    return tables
+
+
+def record_width(space):
+    """Bytes needed to store any 'both' index of ``space``"""
+    return max(1, ((space.size('both') - 1).bit_length() + 7) // 8)
+
+
+class CorpusWriter:
+    """Streams 'both' indices of a UserAgentSpace into a corpus file"""
+
+    def __init__(self, path, space):
+        self.space = space
+        self.width = record_width(space)
+        self.count = 0
+        self.buffer = bytearray()
+        header = json.dumps({
+            'android_devices': space.android_devices,
+            'android_classes': space.android_classes,
+            'chrome_versions': space.chrome_versions,
+            'ios_platforms': space.ios_platforms,
+            'components': component_tables()
+        }, separators=(',', ':')).encode('utf-8')
+
+        self.file = open(path, 'wb')
+        self.file.write(PREAMBLE.pack(MAGIC, VERSION, self.width, len(header), 0))
+        self.file.write(header)
+        self.file.write(b'\0' * (-(PREAMBLE.size + len(header)) % 8))
+
+    def write(self, index):
+        self.buffer += index.to_bytes(self.width, 'big')
+        self.count += 1
+        if len(self.buffer) >= WRITE_BATCH * self.width:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+
+    def write_many(self, indices):
+        for index in indices:
+            self.write(index)
+
+    def close(self):
+        """Flush and record the final count in the preamble"""
+        if self.file.closed:
+            return
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.seek(PREAMBLE.size - 8)
+        self.file.write(self.count.to_bytes(8, 'big'))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class Corpus:
+    """Memory-mapped, random-access reader for corpus files."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path} is not a user agent corpus")
+
+        if len(self.mmap) < PREAMBLE.size:
+            self.close()
+            raise ValueError(f"{path} is not a user agent corpus")
+        magic, version, self.width, header_length, self.count = PREAMBLE.unpack_from(self.mmap)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a user agent corpus")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported corpus version {version}")
+
+        header = json.loads(self.mmap[PREAMBLE.size:PREAMBLE.size + header_length])
+        if header['components'] != component_tables():
+            self.close()
+            raise ValueError("Corpus was written with different decoration tables than this version uses")
+        self.space = UserAgentSpace(
+            (tuple(device) for device in header['android_devices']),
+            header['chrome_versions'],
+            (tuple(platform) for platform in header['ios_platforms']),
+            header['android_classes']
+        )
+        self.offset = PREAMBLE.size + header_length
+        self.offset += -self.offset % 8
+
+    def __len__(self):
+        return self.count
+
+    def index_at(self, position):
+        """Raw 'both' index of the user agent at ``position``"""
+        if position < 0:
+            position += self.count
+        if not 0 <= position < self.count:
+            raise IndexError("corpus index out of range")
+        start = self.offset + position * self.width
+        return int.from_bytes(self.mmap[start:start + self.width], 'big')
+
+    def __getitem__(self, position):
+        return self.space.render(self.index_at(position))
+
+    def iter_indices(self, start=0, stop=None):
+        """Yield raw indices for positions ``start .. stop - 1`` in file order"""
+        stop = self.count if stop is None else min(stop, self.count)
+        width = self.width
+        for block in range(start, stop, WRITE_BATCH):
+            end = min(block + WRITE_BATCH, stop)
+            data = self.mmap[self.offset + block * width:self.offset + end * width]
+            for i in range(0, len(data), width):
+                yield int.from_bytes(data[i:i + width], 'big')
+
+    def iter_range(self, start=0, stop=None):
+        """Yield rendered user agents for positions ``start .. stop - 1``"""
+        render = self.space.render
+        for index in self.iter_indices(start, stop):
+            yield render(index)
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def close(self):
+        if getattr(self, 'mmap', None) is not None and not self.mmap.closed:
+            self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,116 @@
+"""Lightweight asyncio daemon serving user agents over a line protocol.
+
+Clients send one request per line and get one user agent per line back:
+
+    android        -> 1 Android user agent
+    ios 5          -> 5 iOS user agents
+    both 10        -> 10 user agents, Android or iOS at random
+    ping           -> PONG
+
+Invalid requests get a single "ERR <message>" line. User agents come straight
+from the generator's in-memory state; persistence to the database happens in
+the background in batches, off the request path.
+"""
+import asyncio
+import os
+import signal
+
+DEVICE_TYPES = ('android', 'ios', 'both')
+
+
+class UserAgentDaemon:
+    def __init__(self, generator, max_count=1000, save=True, flush_interval=1.0, flush_size=5000):
+        self.generator = generator
+        self.max_count = max_count
+        self.save = save
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending = []
+        self.flush_wanted = None
+
+    def handle_line(self, line):
+        """Turn one request line into the response text"""
+        parts = line.split()
+        if not parts:
+            return "ERR empty request\n"
+
+        command = parts[0].lower()
+        if command == 'ping':
+            return "PONG\n"
+        if command not in DEVICE_TYPES or len(parts) > 2:
+            return "ERR expected: android|ios|both [count]\n"
+
+        try:
+            count = int(parts[1]) if len(parts) == 2 else 1
+        except ValueError:
+            return "ERR count must be an integer\n"
+        if not 1 <= count <= self.max_count:
+            return f"ERR count must be between 1 and {self.max_count}\n"
+
+        user_agents = [self.generator.generate_ua(command) for _ in range(count)]
+        if self.save:
+            self.pending.extend((ua, 'android' if 'Android' in ua else 'ios') for ua in user_agents)
+            if len(self.pending) >= self.flush_size:
+                self.flush_wanted.set()
+        return '\n'.join(user_agents) + '\n'
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = line.decode('utf-8', errors='replace').strip()
+                if request.lower() == 'quit':
+                    break
+                writer.write(self.handle_line(request).encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def flush(self):
+        """Persist queued user agents in one transaction on a worker thread"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.generator.save_generated_uas, batch)
+
+    async def flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_wanted.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_wanted.clear()
+            await self.flush()
+
+    async def serve(self, host=None, port=None, unix_path=None, ready=None):
+        """Run until cancelled; listens on ``unix_path`` if given, else host:port"""
+        self.flush_wanted = asyncio.Event()
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+
+        flusher = asyncio.create_task(self.flush_loop()) if self.save else None
+        try:
+            # Stop cleanly (flushing pending saves) on SIGTERM as well as Ctrl+C
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except (NotImplementedError, AttributeError):
+            pass
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if flusher is not None:
+                flusher.cancel()
+                await self.flush()
+            if unix_path and os.path.exists(unix_path):
+                os.remove(unix_path)
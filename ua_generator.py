@@ -4,22 +4,226 @@ import click
 import random
 import json
 import re
-from faker import Faker
+import hashlib
+import threading
+import csv
+import gzip
+import bz2
+import lzma
+import io
+import itertools
+import bisect
+import multiprocessing
+from collections import deque
+from collections import namedtuple
+from collections import OrderedDict
+from contextlib import nullcontext
 from tqdm import tqdm
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import time
+import metrics
+from ua_sampling import (
+    ANDROID_BUILD_LETTERS, ANDROID_BUILD_NUMBERS, ANDROID_BUILD_PREFIXES, ANDROID_EXTRA_TAG_RATE, ANDROID_EXTRA_TAGS,
+    ANDROID_WEBKIT_MINORS, FORM_FACTORS, IOS_APP_MAJORS, IOS_APP_MINORS, IOS_APPS, IOS_CRIOS_BUILDS, IOS_CRIOS_MAJORS,
+    IOS_CRIOS_PATCHES, IOS_MOBILE_VERSIONS, IOS_WEBKIT_VERSIONS, CatalogFacets, CompatibilityIndex, DiskDedup, HeaderHints,
+    UserAgentSpace, WeightProfile, ios_device_type, render_android_ua, render_ios_ua
+)
+
+# Compiled weight profiles kept per generator, and the bundled profile definitions
+PROFILE_CACHE_SIZE = 32
+# Resolved filter subsets and filtered samplers, cached apart so filters never evict profiles
+FILTER_CACHE_SIZE = 64
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles.json')
+
+# Accept-Language values sent alongside generated user agents, with cumulative weights
+ACCEPT_LANGUAGES = (
+    'en-US,en;q=0.9',
+    'en-GB,en;q=0.9',
+    'en-US,en;q=0.9,es;q=0.8',
+    'de-DE,de;q=0.9,en;q=0.8',
+    'fr-FR,fr;q=0.9,en;q=0.8',
+    'es-ES,es;q=0.9,en;q=0.8',
+    'pt-BR,pt;q=0.9,en;q=0.8',
+    'ja-JP,ja;q=0.9,en;q=0.8'
+)
+ACCEPT_LANGUAGE_CUM_WEIGHTS = tuple(itertools.accumulate((40, 10, 10, 8, 8, 8, 8, 8)))
+
+# In-memory snapshot of the catalog tables (tuples of rows, ordered by id)
+Catalog = namedtuple('Catalog', ['android_devices', 'ios_devices', 'chrome_versions', 'safari_versions'])
+
+# Seconds the cached generated_agents id range is trusted by random_agents(), and ids per lookup query
+RANDOM_RANGE_TTL = 5.0
+RANDOM_LOOKUP_BATCH = 500
+
+# Natural-key columns of each catalog table, in insert order
+CATALOG_COLUMNS = {
+    'android_devices': ('manufacturer', 'model', 'android_version'),
+    'ios_devices': ('model', 'ios_version'),
+    'chrome_versions': ('version', 'build'),
+    'safari_versions': ('version', 'build')
+}
+
+
+def ua_hash(ua):
+    """Stable signed 64-bit dedup key for a user agent (fits an SQLite INTEGER)"""
+    digest = hashlib.blake2b(ua.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def score_user_agent(ua, rng=random):
+    """Calculate entropy score for a user agent string"""
+    score = 0
+    total_checks = 0
+    
+    # Check device and version entropy
+    if 'Android' in ua:
+        # Check Android version format
+        if re.search(r'Android \d+\.\d+', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check device manufacturer presence
+        manufacturers = ['Samsung', 'Google', 'OnePlus', 'Motorola', 'Nothing', 'ASUS', 'Sony', 'TCL']
+        if any(mfr in ua for mfr in manufacturers):
+            score += 1
+        total_checks += 1
+        
+        # Check Chrome version format
+        if re.search(r'Chrome/\d+\.\d+\.\d+\.\d+', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check build tag entropy
+        if re.search(r'Build/[A-Z]{2}[A-Z0-9]\d{6}', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check WebKit version variation
+        if re.search(r'WebKit/537\.(34|35|36)', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check for additional tags
+        if any(tag in ua for tag in ['wv', 'EdgA', 'GoogleApp', 'Mobile Safari']):
+            score += 1
+        total_checks += 1
+        
+    else:  # iOS
+        # Check iOS version format
+        if re.search(r'OS \d+_\d+(_\d+)? like Mac OS X', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check device type
+        if any(device in ua for device in ['iPhone', 'iPad']):
+            score += 1
+        total_checks += 1
+        
+        # Check Safari/WebKit version
+        if re.search(r'Version/\d+\.\d+(\.\d+)?', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check Mobile version code
+        if re.search(r'Mobile/[0-9A-Z]+', ua):
+            score += 1
+        total_checks += 1
+        
+        # Check for variations
+        if any(var in ua for var in ['CriOS', 'FxiOS', 'EdgiOS', 'GSA']):
+            score += 1
+        total_checks += 1
+        
+        # Check WebKit version
+        if re.search(r'WebKit/60[0-9]\.\d+\.\d+', ua):
+            score += 1
+        total_checks += 1
+    
+    # Calculate percentage
+    entropy_score = (score / total_checks) * 100
+    
+    # Add randomization factor (±2%) to prevent pattern detection
+    entropy_score += rng.uniform(-2, 2)
+    
+    # Ensure score stays within 0-100 range
+    entropy_score = max(0, min(100, entropy_score))
+    
+    return round(entropy_score, 1)
+
+
+def score_histogram(scores):
+    """Bucket entropy scores into 10-point bins ('0-10' ... '90-100')"""
+    histogram = {f"{low}-{low + 10}": 0 for low in range(0, 100, 10)}
+    for score in scores:
+        low = min(int(score // 10) * 10, 90)
+        histogram[f"{low}-{low + 10}"] += 1
+    return histogram
+
 
 class UserAgentGenerator:
-    def __init__(self, db_path='useragents.db'):
+    """Generates user agents from an immutable in-memory snapshot of the catalog."""
+    
+    def __init__(self, db_path='useragents.db', seed=None, shard=None):
         self.db_path = db_path
-        self.fake = Faker('en_US')
+        self.seed = seed
+        self.shard = shard or (0, 1)
+        self._local = threading.local()
+        self._thread_ids = itertools.count()
+        self._listeners = ()
+        self._notify_lock = threading.Lock()
+        self._id_range = None
+        self.profiles = {}
+        self._profile_keys = {}
+        self._compiled_profiles = OrderedDict()
+        self._compiled_filters = OrderedDict()
+        self._filter_subsets = OrderedDict()
+        self._profiles_lock = threading.Lock()
         self.setup_database()
+        self.reload_catalog()
+        if os.path.exists(PROFILES_PATH):
+            self.load_profiles(PROFILES_PATH)
+        
+    @property
+    def rng(self):
+        """Random number generator owned by the calling thread"""
+        try:
+            return self._local.rng
+        except AttributeError:
+            seed = None if self.seed is None else f"{self.seed}:{next(self._thread_ids)}"
+            rng = self._local.rng = random.Random(seed)
+            return rng
+        
+    def seed_thread(self, seed):
+        """Reseed the calling thread's generator (for reproducible streams)"""
+        self._local.rng = random.Random(seed)
+        
+    def connect(self, **kwargs):
+        """Open a connection to the UA database (traced when metrics are enabled)"""
+        return metrics.attach(sqlite3.connect(self.db_path, **kwargs))
         
     def setup_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
+        # Incremental auto-vacuum lets retention hand pages back to the OS without
+        # a full VACUUM. New databases get it for free; existing ones are converted
+        # explicitly (archive --convert), never on startup
+        if not cursor.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        
+        # WAL lets readers (stats, exports) run alongside the writer
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Rebuilding the table copies every row: never do it implicitly on startup
+        if self._generated_agents_outdated(cursor):
+            conn.close()
+            raise RuntimeError(
+                f"{self.db_path} has a generated_agents table from an older version (or an interrupted "
+                f"upgrade); stop the service and run 'python ua_generator.py migrate --db {self.db_path}'"
+            )
+        
         # Create tables for devices and user agents
         cursor.executescript('''
             CREATE TABLE IF NOT EXISTS android_devices (
@@ -47,12 +251,26 @@ class UserAgentGenerator:
                 build TEXT
             );
             
+            -- Dedup is keyed on ua_hash: its index holds 8-byte integers rather
+            -- than a second copy of every user agent string
             CREATE TABLE IF NOT EXISTS generated_agents (
                 id INTEGER PRIMARY KEY,
-                user_agent TEXT UNIQUE,
+                ua_hash INTEGER NOT NULL,
+                user_agent TEXT,
                 device_type TEXT,
                 created_at TIMESTAMP
             );
+            
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_generated_agents_hash
+                ON generated_agents (ua_hash);
+            
+            -- Keyset pages filtered by device type walk this index in rowid order
+            CREATE INDEX IF NOT EXISTS idx_generated_agents_device
+                ON generated_agents (device_type);
+            
+            -- Covers the GROUP BY device_type / MIN, MAX(created_at) stats queries
+            CREATE INDEX IF NOT EXISTS idx_generated_agents_device_created
+                ON generated_agents (device_type, created_at);
         ''')
         
         # Populate initial data if tables are empty
@@ -71,6 +289,247 @@ class UserAgentGenerator:
         conn.commit()
         conn.close()
 
+    def incremental_vacuum_enabled(self):
+        """Whether the database frees pages incrementally after retention deletes"""
+        conn = self.connect()
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        finally:
+            conn.close()
+
+    def convert_to_incremental_vacuum(self):
+        """Switch an existing database to incremental auto-vacuum (rewrites the file with VACUUM)"""
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    @classmethod
+    def migrate_database(cls, db_path='useragents.db'):
+        """Rebuild a pre-hash generated_agents table around ua_hash; returns False if it was up to date"""
+        conn = metrics.attach(sqlite3.connect(db_path))
+        try:
+            cursor = conn.cursor()
+            if not cls._generated_agents_outdated(cursor):
+                return False
+            cls._migrate_generated_agents(cursor)
+            # The old table's pages are now free: hand them back instead of growing the file
+            if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                cursor.execute("PRAGMA incremental_vacuum")
+            else:
+                cursor.execute("VACUUM")
+            return True
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _generated_agents_outdated(cursor):
+        """Whether generated_agents predates ua_hash, or an earlier rebuild stopped halfway"""
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(generated_agents)")]
+        leftover = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'generated_agents_old'"
+        ).fetchone()
+        return bool(leftover) or (bool(columns) and 'ua_hash' not in columns)
+
+    @staticmethod
+    def _migrate_generated_agents(cursor):
+        """Copy generated_agents into the ua_hash schema in one transaction"""
+        # A generated_agents_old left behind means an earlier rebuild stopped halfway: finish it
+        leftover = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'generated_agents_old'"
+        ).fetchone()
+        conn = cursor.connection
+        conn.create_function('ua_hash', 1, ua_hash, deterministic=True)
+        # Explicit transaction: the sqlite3 module would otherwise autocommit each DDL statement
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if not leftover:
+                cursor.execute("ALTER TABLE generated_agents RENAME TO generated_agents_old")
+            cursor.execute("DROP INDEX IF EXISTS idx_generated_agents_device_created")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS generated_agents (
+                    id INTEGER PRIMARY KEY,
+                    ua_hash INTEGER NOT NULL,
+                    user_agent TEXT,
+                    device_type TEXT,
+                    created_at TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                INSERT OR IGNORE INTO generated_agents (id, ua_hash, user_agent, device_type, created_at)
+                SELECT id, ua_hash(user_agent), user_agent, device_type, created_at
+                FROM generated_agents_old
+                ORDER BY id
+            """)
+            cursor.execute("DROP TABLE generated_agents_old")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def reload_catalog(self):
+        """Load the catalog tables into memory and rebuild the UA space"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        catalog = Catalog(
+            android_devices=tuple(cursor.execute(
+                "SELECT manufacturer, model, android_version FROM android_devices ORDER BY id"
+            ).fetchall()),
+            ios_devices=tuple(cursor.execute(
+                "SELECT model, ios_version FROM ios_devices ORDER BY id"
+            ).fetchall()),
+            chrome_versions=tuple(cursor.execute(
+                "SELECT version, build FROM chrome_versions ORDER BY id"
+            ).fetchall()),
+            safari_versions=tuple(cursor.execute(
+                "SELECT version, build FROM safari_versions ORDER BY id"
+            ).fetchall())
+        )
+        
+        conn.close()
+        
+        # Swap in a new snapshot; readers take a local reference, so no locks are needed
+        self.catalog = catalog
+        self.compat = CompatibilityIndex(catalog)
+        self.space = UserAgentSpace.from_catalog(catalog, self.compat)
+        self.hints = HeaderHints(catalog)
+        self.facets = CatalogFacets(catalog)
+        # Unweighted sampler behind plain generation; one attribute, so one snapshot
+        self.uniform = WeightProfile({}, self.hints, self.compat)
+        
+        # Compiled profiles and filter subsets index rows of the old snapshot
+        with self._profiles_lock:
+            self._compiled_profiles = OrderedDict()
+            self._compiled_filters = OrderedDict()
+            self._filter_subsets = OrderedDict()
+
+    def register_profile(self, name, spec):
+        """Define (or redefine) a named weight profile; it is compiled on first use"""
+        WeightProfile.validate(spec)
+        self.profile_sampler(spec)
+        self.profiles[name] = spec
+        self._profile_keys[name] = WeightProfile.key(spec)
+
+    def load_profiles(self, path):
+        """Register every profile in a JSON file of {name: profile}"""
+        with open(path, encoding='utf-8') as f:
+            profiles = json.load(f)
+        for name, spec in profiles.items():
+            self.register_profile(name, spec)
+
+    def profile_sampler(self, profile=None, filters=None):
+        """Return the compiled WeightProfile for a profile name or definition, restricted by ``filters``"""
+        if isinstance(profile, WeightProfile):
+            return profile
+        uniform = self.uniform
+        filters = CatalogFacets.normalize(filters)
+        if profile is None:
+            base, key = uniform, None
+        elif isinstance(profile, str):
+            key = self._profile_keys.get(profile)
+            if key is None:
+                raise ValueError(f"Unknown weight profile '{profile}'")
+            base = self._compiled(self._compiled_profiles, PROFILE_CACHE_SIZE, key, uniform,
+                                  lambda: WeightProfile(self.profiles[profile], uniform.hints, uniform.compat))
+        else:
+            key = WeightProfile.key(profile)
+            base = self._compiled(self._compiled_profiles, PROFILE_CACHE_SIZE, key, uniform,
+                                  lambda: WeightProfile(profile, uniform.hints, uniform.compat))
+        if not filters:
+            return base
+        
+        # A filtered sampler is its base profile with only the tables the filters touch rebuilt
+        filter_key = CatalogFacets.key(filters)
+        subsets = self._compiled(self._filter_subsets, FILTER_CACHE_SIZE, filter_key, uniform,
+                                 lambda: self._select(filters, uniform))
+        return self._compiled(self._compiled_filters, FILTER_CACHE_SIZE, (key, filter_key), uniform,
+                              lambda: base.restrict(subsets))
+
+    def _compiled(self, cache, size, key, uniform, build):
+        """LRU lookup in one of the compile caches, building (outside the lock) on a miss"""
+        with self._profiles_lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] is uniform.hints:
+                cache.move_to_end(key)
+                return entry[1]
+        value = build()
+        with self._profiles_lock:
+            cache[key] = (uniform.hints, value)
+            while len(cache) > size:
+                cache.popitem(last=False)
+        return value
+
+    def _select(self, filters, uniform):
+        """Resolve normalized filters against the facets of ``uniform``'s snapshot"""
+        facets = self.facets
+        if facets.catalog is not uniform.hints.catalog:
+            # Caught between the assignments in reload_catalog()
+            facets = CatalogFacets(uniform.hints.catalog)
+        return facets.select(filters)
+
+    def import_catalog(self, table, rows, batch_size=50000):
+        """Bulk-load catalog rows into ``table`` and reload the in-memory catalog
+        
+        ``rows`` is any iterable of tuples in CATALOG_COLUMNS order; it is
+        streamed into an unindexed temporary staging table in large executemany
+        transactions, with syncs off for the load. The staging index is built
+        afterwards; it serves both to drop rows the table already holds and to
+        pick the first occurrence of every duplicate, so the catalog table
+        itself needs no extra index. Returns (rows read, rows inserted).
+        """
+        if table not in CATALOG_COLUMNS:
+            raise ValueError(f"Unknown catalog table '{table}' (choose from {', '.join(CATALOG_COLUMNS)})")
+        columns = ', '.join(CATALOG_COLUMNS[table])
+        matches = ' AND '.join(f"t.{column} = s.{column}" for column in CATALOG_COLUMNS[table])
+        placeholders = ', '.join('?' * len(CATALOG_COLUMNS[table]))
+        read = 0
+        
+        conn = self.connect(timeout=30)
+        try:
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-262144")
+            conn.execute(f"CREATE TEMP TABLE catalog_import ({columns})")
+            
+            rows = iter(rows)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                with conn:
+                    conn.executemany(f"INSERT INTO catalog_import VALUES ({placeholders})", batch)
+                read += len(batch)
+            
+            conn.execute(f"CREATE INDEX temp.idx_catalog_import ON catalog_import ({columns})")
+            with conn:
+                # Drop rows the table already holds (a scan of the table probing
+                # the staging index), then copy first occurrences in file order
+                conn.execute(f"""
+                    DELETE FROM catalog_import WHERE rowid IN (
+                        SELECT s.rowid FROM {table} t JOIN catalog_import s ON {matches}
+                    )
+                """)
+                before = conn.total_changes
+                conn.execute(f"""
+                    INSERT INTO {table} ({columns})
+                    SELECT {columns} FROM catalog_import
+                    WHERE rowid IN (SELECT MIN(rowid) FROM catalog_import GROUP BY {columns})
+                    ORDER BY rowid
+                """)
+                inserted = conn.total_changes - before
+        finally:
+            conn.close()
+        
+        self.reload_catalog()
+        return read, inserted
+
+    def space_size(self, device_type='both'):
+        """Number of distinct user agents this generator's shard can produce for a device type"""
+        return self.space.shard_size(device_type, self.shard)
+
     def _populate_android_data(self, cursor):
         """Populate Android device data"""
         android_devices = [
@@ -316,322 +775,603 @@ class UserAgentGenerator:
 
     def calculate_entropy_score(self, ua):
         """Calculate entropy score for a user agent string"""
-        score = 0
-        total_checks = 0
-        
-        # Check device and version entropy
-        if 'Android' in ua:
-            # Check Android version format
-            if re.search(r'Android \d+\.\d+', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check device manufacturer presence
-            manufacturers = ['Samsung', 'Google', 'OnePlus', 'Motorola', 'Nothing', 'ASUS', 'Sony', 'TCL']
-            if any(mfr in ua for mfr in manufacturers):
-                score += 1
-            total_checks += 1
-            
-            # Check Chrome version format
-            if re.search(r'Chrome/\d+\.\d+\.\d+\.\d+', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check build tag entropy
-            if re.search(r'Build/[A-Z]{2}[A-Z0-9]\d{6}', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check WebKit version variation
-            if re.search(r'WebKit/537\.(34|35|36)', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check for additional tags
-            if any(tag in ua for tag in ['wv', 'EdgA', 'GoogleApp', 'Mobile Safari']):
-                score += 1
-            total_checks += 1
-            
-        else:  # iOS
-            # Check iOS version format
-            if re.search(r'OS \d+_\d+(_\d+)? like Mac OS X', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check device type
-            if any(device in ua for device in ['iPhone', 'iPad']):
-                score += 1
-            total_checks += 1
-            
-            # Check Safari/WebKit version
-            if re.search(r'Version/\d+\.\d+(\.\d+)?', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check Mobile version code
-            if re.search(r'Mobile/[0-9A-Z]+', ua):
-                score += 1
-            total_checks += 1
-            
-            # Check for variations
-            if any(var in ua for var in ['CriOS', 'FxiOS', 'EdgiOS', 'GSA']):
-                score += 1
-            total_checks += 1
-            
-            # Check WebKit version
-            if re.search(r'WebKit/60[0-9]\.\d+\.\d+', ua):
-                score += 1
-            total_checks += 1
-        
-        # Calculate percentage
-        entropy_score = (score / total_checks) * 100
-        
-        # Add randomization factor (±2%) to prevent pattern detection
-        entropy_score += random.uniform(-2, 2)
-        
-        # Ensure score stays within 0-100 range
-        entropy_score = max(0, min(100, entropy_score))
-        
-        return round(entropy_score, 1)
+        with metrics.timer('entropy_score'):
+            return score_user_agent(ua, self.rng)
+
+    def add_listener(self, listener):
+        """Call ``listener(rows)`` with the (id, user_agent, device_type, created_at) rows of every save"""
+        # Listeners run on the saving thread, in id order, and must not block.
+        # Copy-on-write, so saves iterate a stable tuple without locking
+        self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        self._listeners = tuple(l for l in self._listeners if l is not listener)
+
+    def _notify(self, rows):
+        for listener in self._listeners:
+            listener(rows)
+
+    def _notifying(self):
+        """Lock held from insert to notify while anyone listens, so rows reach listeners in id order"""
+        return self._notify_lock if self._listeners else nullcontext()
 
     def save_generated_ua(self, ua, device_type):
         """Save generated user agent to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        created_at = datetime.now().isoformat()
         
+        with self._notifying():
+            conn = self.connect()
+            cursor = conn.cursor()
+            try:
+                with metrics.timer('save'):
+                    cursor.execute(
+                        "INSERT INTO generated_agents (ua_hash, user_agent, device_type, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (ua_hash(ua), ua, device_type, created_at)
+                    )
+                    conn.commit()
+            except sqlite3.IntegrityError:
+                # Skip if duplicate
+                return
+            finally:
+                conn.close()
+            
+            if self._listeners:
+                self._notify([(cursor.lastrowid, ua, device_type, created_at)])
+
+    def save_generated_uas(self, user_agents):
+        """Save many (user_agent, device_type) pairs in a single transaction"""
+        created_at = datetime.now().isoformat()
+        
+        with self._notifying():
+            listening = bool(self._listeners)
+            rows = None
+            conn = self.connect()
+            try:
+                with metrics.timer('save_batch'), conn:
+                    if listening:
+                        # Hold the write lock from the first read, so the rows read
+                        # back after the insert are exactly the ones this call added
+                        conn.execute("BEGIN IMMEDIATE")
+                        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM generated_agents").fetchone()[0]
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO generated_agents (ua_hash, user_agent, device_type, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        ((ua_hash(ua), ua, device_type, created_at) for ua, device_type in user_agents)
+                    )
+                    if listening:
+                        rows = conn.execute("""
+                            SELECT id, user_agent, device_type, created_at
+                            FROM generated_agents
+                            WHERE id > ?
+                            ORDER BY id
+                        """, (last_id,)).fetchall()
+            finally:
+                conn.close()
+            
+            if rows:
+                self._notify(rows)
+
+    def iter_generated_agents(self, device_type=None, since=None, until=None, after_id=0, batch_size=5000):
+        """Stream stored user agents as (id, user_agent, device_type, created_at) rows"""
+        query, filters = self._agents_page_query(device_type, since, until)
+        
+        conn = self.connect()
         try:
-            cursor.execute(
-                "INSERT INTO generated_agents (user_agent, device_type, created_at) VALUES (?, ?, ?)",
-                (ua, device_type, datetime.now().isoformat())
-            )
-            conn.commit()
-        except sqlite3.IntegrityError:
-            # Skip if duplicate
-            pass
+            while True:
+                rows = conn.execute(query, (after_id, *filters, batch_size)).fetchall()
+                if not rows:
+                    break
+                yield from rows
+                if len(rows) < batch_size:
+                    break
+                after_id = rows[-1][0]
         finally:
             conn.close()
 
-    def generate_batch(self, count, device_type='both'):
-        """Generate a batch of user agents"""
+    def agents_page(self, after_id=0, limit=1000, device_type=None):
+        """Return one keyset page of stored rows with id > ``after_id``, in id order"""
+        query, filters = self._agents_page_query(device_type)
+        conn = self.connect()
+        try:
+            return conn.execute(query, (after_id, *filters, limit)).fetchall()
+        finally:
+            conn.close()
+
+    def random_agents(self, count=1, device_type=None, max_rounds=16):
+        """Draw ``count`` stored rows at random (with replacement); uniform unless a rare device type forces the index-scan fallback"""
+        id_range = self._id_range
+        if id_range is None or time.monotonic() - id_range[2] > RANDOM_RANGE_TTL:
+            id_range = self._refresh_id_range()
+        low, high = id_range[0], id_range[1]
+        if high is None:
+            return []
+        
+        rng = self.rng
+        picked = []
+        conn = self.connect()
+        try:
+            for _ in range(max_rounds):
+                # Over-draw to cover gaps and other-type hits in a single query
+                ids = [rng.randint(low, high) for _ in range(2 * (count - len(picked)) + 8)]
+                found = {}
+                for start in range(0, len(ids), RANDOM_LOOKUP_BATCH):
+                    chunk = ids[start:start + RANDOM_LOOKUP_BATCH]
+                    rows = conn.execute(
+                        f"SELECT id, user_agent, device_type, created_at FROM generated_agents "
+                        f"WHERE id IN ({', '.join('?' * len(chunk))})",
+                        chunk
+                    ).fetchall()
+                    found.update((row[0], row) for row in rows if not device_type or row[2] == device_type)
+                picked.extend(found[row_id] for row_id in ids if row_id in found)
+                if len(picked) >= count:
+                    return picked[:count]
+            
+            # Rejection sampling ran out of rounds (a rare device type): take the next
+            # match after a random id instead. Not uniform: rows right after a long
+            # gap of archived or other-type ids are picked more often
+            type_clause, type_params = ("device_type = ? AND ", (device_type,)) if device_type else ("", ())
+            while len(picked) < count:
+                row = conn.execute(f"""
+                    SELECT id, user_agent, device_type, created_at FROM generated_agents
+                    WHERE {type_clause}id >= ?
+                    ORDER BY id
+                    LIMIT 1
+                """, type_params + (rng.randint(low, high),)).fetchone()
+                if row is None:
+                    # Past the last match: wrap around to the first one
+                    row = conn.execute(f"""
+                        SELECT id, user_agent, device_type, created_at FROM generated_agents
+                        WHERE {type_clause}id >= ?
+                        ORDER BY id
+                        LIMIT 1
+                    """, type_params + (low,)).fetchone()
+                    if row is None:
+                        break
+                picked.append(row)
+            return picked
+        finally:
+            conn.close()
+
+    def _refresh_id_range(self):
+        conn = self.connect()
+        try:
+            low, high = conn.execute("SELECT MIN(id), MAX(id) FROM generated_agents").fetchone()
+        finally:
+            conn.close()
+        self._id_range = (low, high, time.monotonic())
+        return self._id_range
+
+    @staticmethod
+    def _agents_page_query(device_type=None, since=None, until=None):
+        """Build the keyset page query; parameters are (after_id, *filters, limit)"""
+        conditions = ["id > ?"]
+        filters = []
+        if device_type:
+            conditions.append("device_type = ?")
+            filters.append(device_type)
+        if since:
+            conditions.append("created_at >= ?")
+            filters.append(since)
+        if until:
+            conditions.append("created_at < ?")
+            filters.append(until)
+        
+        query = f"""
+            SELECT id, user_agent, device_type, created_at
+            FROM generated_agents
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id
+            LIMIT ?
+        """
+        return query, filters
+
+    def archive_generated_agents(self, older_than_days, archive_path=None, batch_size=5000):
+        """Move stored user agents older than N days out of generated_agents"""
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        to_database = archive_path is not None and not archive_path.endswith('.gz')
+        removed = 0
+        
+        conn = self.connect(timeout=30)
+        try:
+            if to_database:
+                conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS archive.generated_agents (
+                        id INTEGER PRIMARY KEY,
+                        user_agent TEXT,
+                        device_type TEXT,
+                        created_at TIMESTAMP
+                    )
+                """)
+            
+            while True:
+                # created_at follows insertion order, so expired rows form an id prefix
+                rows = conn.execute("""
+                    SELECT id, user_agent, device_type, created_at
+                    FROM generated_agents
+                    ORDER BY id
+                    LIMIT ?
+                """, (batch_size,)).fetchall()
+                expired = []
+                for row in rows:
+                    if row[3] >= cutoff:
+                        break
+                    expired.append(row)
+                if not expired:
+                    break
+                
+                first_id, last_id = expired[0][0], expired[-1][0]
+                if archive_path and not to_database:
+                    with gzip.open(archive_path, 'at', encoding='utf-8') as f:
+                        for row in expired:
+                            f.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+                
+                with conn:
+                    if to_database:
+                        conn.execute("""
+                            INSERT OR IGNORE INTO archive.generated_agents
+                            SELECT id, user_agent, device_type, created_at
+                            FROM main.generated_agents
+                            WHERE id BETWEEN ? AND ?
+                        """, (first_id, last_id))
+                    conn.execute("DELETE FROM main.generated_agents WHERE id BETWEEN ? AND ?", (first_id, last_id))
+                
+                removed += len(expired)
+                if len(expired) < len(rows) or len(rows) < batch_size:
+                    break
+            
+            if removed:
+                conn.execute("PRAGMA main.incremental_vacuum")
+        finally:
+            conn.close()
+        
+        return removed
+
+    def generate_unique_batch(self, count, device_type='both', seed=None, start=0):
+        """Generate a batch of user agents that are distinct by construction"""
+        if self.shard[1] > 1 and seed is None:
+            raise ValueError("Sharded generation needs a seed shared by all shards")
+        user_agents = list(tqdm(
+            self.space.iter_unique(count, device_type, seed=seed, start=start, shard=self.shard),
+            total=count,
+            desc="Generating User Agents"
+        ))
+        self.save_generated_uas((ua, 'android' if 'Android' in ua else 'ios') for ua in user_agents)
+        
+        return user_agents
+
+    def _batch_candidate(self, device_type, profile=None, filters=None):
+        """Generate one batch candidate, occasionally with a minor variation"""
+        ua = self.generate_ua(device_type, profile, filters)
+        
+        # Add entropy by slightly modifying the user agent
+        if self.rng.random() < 0.1:  # 10% chance to add minor variations
+            ua = ua.replace("Mobile", "Mobile Safari")
+        
+        return ua
+
+    def generate_batch(self, count, device_type='both', profile=None, filters=None):
+        """Generate a batch of user agents (optionally weighted by a profile and filtered)"""
+        profile = self.profile_sampler(profile, filters)
+        profile.check_device_type(device_type)
+        filters = None
         user_agents = []
+        seen = set()
         
         with tqdm(total=count, desc="Generating User Agents") as pbar:
             while len(user_agents) < count:
-                if device_type == 'android':
-                    ua = self.generate_android_ua()
-                elif device_type == 'ios':
-                    ua = self.generate_ios_ua()
-                else:
-                    ua = self.generate_android_ua() if random.random() < 0.5 else self.generate_ios_ua()
+                ua = self._batch_candidate(device_type, profile, filters)
                 
-                # Add entropy by slightly modifying the user agent
-                if random.random() < 0.1:  # 10% chance to add minor variations
-                    ua = ua.replace("Mobile", "Mobile Safari")
-                
-                if ua not in user_agents:
+                if ua not in seen:
+                    seen.add(ua)
                     user_agents.append(ua)
                     self.save_generated_ua(ua, 'android' if 'Android' in ua else 'ios')
                     pbar.update(1)
         
         return user_agents
 
-    def generate_android_ua(self):
-        """Generate Android user agent with entropy"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get device with weighted probability (newer devices more likely)
-        device = cursor.execute("""
-            WITH RECURSIVE
-            cnt(x) AS (
-                SELECT 1
-                UNION ALL
-                SELECT x+1 FROM cnt LIMIT 100
-            ),
-            weighted_devices AS (
-                SELECT d.*, 
-                    CASE 
-                        WHEN android_version = '14.0' THEN x % 3 + 3
-                        WHEN android_version = '13.0' THEN x % 2 + 1
-                        ELSE 1
-                    END as weight
-                FROM android_devices d
-                CROSS JOIN cnt
-            )
-            SELECT manufacturer, model, android_version
-            FROM weighted_devices
-            ORDER BY RANDOM()
-            LIMIT 1
-        """).fetchone()
-        
-        # Get Chrome version with weighted probability (newer versions more likely)
-        chrome_version = cursor.execute("""
-            WITH RECURSIVE
-            cnt(x) AS (
-                SELECT 1
-                UNION ALL
-                SELECT x+1 FROM cnt LIMIT 100
-            ),
-            weighted_versions AS (
-                SELECT v.*, 
-                    CASE 
-                        WHEN version LIKE '121%' THEN x % 4 + 4
-                        WHEN version LIKE '120%' THEN x % 3 + 2
-                        WHEN version LIKE '119%' THEN x % 2 + 1
-                        ELSE 1
-                    END as weight
-                FROM chrome_versions v
-                CROSS JOIN cnt
-            )
-            SELECT version, build
-            FROM weighted_versions
-            ORDER BY RANDOM()
-            LIMIT 1
-        """).fetchone()
-        
-        conn.close()
-        
-        # Generate realistic build ID
-        build_prefixes = ['QP', 'RP', 'SP', 'TP']
-        build_id = f"{random.choice(build_prefixes)}{self.fake.random_letter()}{self.fake.random_number(6)}"
-        
-        # Add entropy to the WebKit version
-        webkit_version = f"537.{random.randint(34,36)}"
-        
-        # Randomly add build tags
-        build_tags = [
-            f"wv",  # WebView
-            f"Build/{build_id}",
-            f"{build_id}",
-            ""  # No build tag
-        ]
-        build_tag = random.choice(build_tags)
+    def iter_batches(self, count, device_type='both', batch_size=1000, profile=None, filters=None):
+        """Yield ``count`` distinct user agents in saved lists of up to ``batch_size``"""
+        profile = self.profile_sampler(profile, filters)
+        profile.check_device_type(device_type)
+        filters = None
+        seen = set()
+        produced = 0
+        while produced < count:
+            batch = []
+            while len(batch) < min(batch_size, count - produced):
+                ua = self._batch_candidate(device_type, profile, filters)
+                if ua not in seen:
+                    seen.add(ua)
+                    batch.append(ua)
+            self.save_generated_uas((ua, 'android' if 'Android' in ua else 'ios') for ua in batch)
+            produced += len(batch)
+            yield batch
+
+    def generate_records(self, count, device_type='both', profile=None, filters=None):
+        """Generate a batch of distinct user agents, each with its matching headers"""
+        profile = self.profile_sampler(profile, filters)
+        profile.check_device_type(device_type)
+        filters = None
+        records = []
+        seen = set()
         
-        # Base UA string
-        ua = (
-            f"Mozilla/5.0 (Linux; Android {device[2]}; "
-            f"{device[0]} {device[1]}"
-        )
+        with tqdm(total=count, desc="Generating User Agents") as pbar:
+            while len(records) < count:
+                record = self.generate_record(device_type, profile, filters)
+                
+                if record['user_agent'] not in seen:
+                    seen.add(record['user_agent'])
+                    records.append(record)
+                    pbar.update(1)
         
-        # Add build tag if selected
-        if build_tag:
-            ua += f"; {build_tag}"
+        self.save_generated_uas((record['user_agent'], record['device_type']) for record in records)
+        return records
+
+    def generate_batch_external(self, count, output, device_type='both', memory_budget=256 * 2 ** 20,
+                                tmp_dir=None):
+        """Stream exactly ``count`` distinct user agents to ``output``, one per line"""
+        written = 0
+        with DiskDedup(count, memory_budget, tmp_dir) as dedup, \
+                tqdm(total=count, desc="Generating User Agents") as pbar:
+            while written < count:
+                # Over-generate slightly so most jobs finish in a single round
+                deficit = count - written
+                for _ in range(deficit + deficit // 100 + 16):
+                    dedup.add(self._batch_candidate(device_type))
+                
+                for ua in dedup.drain():
+                    if written < count:
+                        output.write(ua + '\n')
+                        written += 1
+                        pbar.update(1)
         
-        # Complete UA string
-        ua += (
-            f") AppleWebKit/{webkit_version} (KHTML, like Gecko) "
-            f"Chrome/{chrome_version[0]} Mobile Safari/{webkit_version}"
-        )
+        return written
+
+    def generate_ua(self, device_type='both', profile=None, filters=None):
+        """Generate a user agent for 'android', 'ios' or 'both' (50/50)"""
+        sampler = self.profile_sampler(profile, filters)
+        if sampler.pick_device_type(device_type, self.rng) == 'android':
+            return self._sample_android(sampler)[0]
+        return self._sample_ios(sampler)
+
+    def generate_record(self, device_type='both', profile=None, filters=None):
+        """Generate a user agent together with the request headers that match it"""
+        sampler = self.profile_sampler(profile, filters)
+        if sampler.pick_device_type(device_type, self.rng) == 'android':
+            return self.generate_android_record(sampler)
+        return self.generate_ios_record(sampler)
+
+    def generate_android_record(self, profile=None, filters=None):
+        """Generate an Android user agent with its client-hint headers"""
+        sampler = self.profile_sampler(profile, filters)
+        sampler.check_device_type('android')
+        hints = sampler.hints
+        ua, device, chrome, build_tag, extra_tag = self._sample_android(sampler)
+        if extra_tag == " EdgA/1.0":
+            flavour = 'edge'
+        elif build_tag == 'wv':
+            flavour = 'webview'
+        else:
+            flavour = 'chrome'
         
-        # Sometimes add additional tags
-        if random.random() < 0.1:  # 10% chance
-            additional_tags = [
-                " EdgA/1.0",
-                " GoogleApp/13.47.8.23",
-                " Chrome/96.0.4664.104 Mobile Safari/537.36",
-                " Mobile"
+        return {
+            'user_agent': ua,
+            'device_type': 'android',
+            'headers': {
+                'User-Agent': ua,
+                'Sec-CH-UA': hints.chrome_brands[chrome][flavour],
+                'Sec-CH-UA-Mobile': '?1',
+                'Sec-CH-UA-Platform': '"Android"',
+                'Sec-CH-UA-Model': hints.android_models[device],
+                'Sec-CH-UA-Platform-Version': hints.android_platform_versions[device],
+                'Accept-Language': self._accept_language()
+            }
+        }
+
+    def generate_ios_record(self, profile=None, filters=None):
+        """Generate an iOS user agent with its headers (no client hints on WebKit)"""
+        sampler = self.profile_sampler(profile, filters)
+        sampler.check_device_type('ios')
+        ua = self._sample_ios(sampler)
+        return {
+            'user_agent': ua,
+            'device_type': 'ios',
+            'headers': {
+                'User-Agent': ua,
+                'Accept-Language': self._accept_language()
+            }
+        }
+
+    def _accept_language(self):
+        position = self.rng.random() * ACCEPT_LANGUAGE_CUM_WEIGHTS[-1]
+        return ACCEPT_LANGUAGES[bisect.bisect(ACCEPT_LANGUAGE_CUM_WEIGHTS, position)]
+
+    def generate_android_ua(self):
+        """Generate Android user agent with entropy"""
+        return self._sample_android(self.uniform)[0]
+
+    def _sample_android(self, sampler):
+        """Sample an Android UA; returns (ua, device row, chrome row, build tag, extra tag)"""
+        with metrics.timer('assemble'):
+            rng = self.rng
+            catalog = sampler.hints.catalog
+            
+            # Pick a device, then a Chrome version compatible with it
+            device_index = sampler.android_devices.sample(rng)
+            chrome_index = sampler.chrome_tables[sampler.android_classes[device_index]].sample(rng)
+            device = catalog.android_devices[device_index]
+            chrome_version = catalog.chrome_versions[chrome_index]
+            
+            # Generate realistic build ID
+            build_id = (
+                f"{rng.choice(ANDROID_BUILD_PREFIXES)}{rng.choice(ANDROID_BUILD_LETTERS)}"
+                f"{rng.randrange(ANDROID_BUILD_NUMBERS)}"
+            )
+            
+            # Add entropy to the WebKit version
+            webkit_minor = rng.choice(ANDROID_WEBKIT_MINORS)
+            
+            # Randomly add build tags
+            build_tags = [
+                f"wv",  # WebView
+                f"Build/{build_id}",
+                f"{build_id}",
+                ""  # No build tag
             ]
-            ua += random.choice(additional_tags)
-        
-        return ua
+            build_tag = build_tags[sampler.android_templates.sample(rng)]
+            
+            # Sometimes add additional tags
+            extra_tag = ''
+            if rng.random() < ANDROID_EXTRA_TAG_RATE:
+                extra_tag = rng.choice(ANDROID_EXTRA_TAGS)
+            
+            ua = render_android_ua(device, chrome_version[0], webkit_minor, build_tag, extra_tag)
+            return ua, device_index, chrome_index, build_tag, extra_tag
 
     def generate_ios_ua(self):
         """Generate iOS user agent with entropy"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get device with weighted probability (newer devices more likely)
-        device = cursor.execute("""
-            WITH RECURSIVE
-            cnt(x) AS (
-                SELECT 1
-                UNION ALL
-                SELECT x+1 FROM cnt LIMIT 100
-            ),
-            weighted_devices AS (
-                SELECT d.*, 
-                    CASE 
-                        WHEN ios_version LIKE '17.3%' THEN x % 4 + 4
-                        WHEN ios_version LIKE '17.2%' THEN x % 3 + 3
-                        WHEN ios_version LIKE '17.1%' THEN x % 2 + 2
-                        WHEN ios_version LIKE '17.0%' THEN x % 2 + 1
-                        ELSE 1
-                    END as weight
-                FROM ios_devices d
-                CROSS JOIN cnt
-            )
-            SELECT model, ios_version
-            FROM weighted_devices
-            ORDER BY RANDOM()
-            LIMIT 1
-        """).fetchone()
-        
-        # Get Safari version with weighted probability (newer versions more likely)
-        safari_version = cursor.execute("""
-            WITH RECURSIVE
-            cnt(x) AS (
-                SELECT 1
-                UNION ALL
-                SELECT x+1 FROM cnt LIMIT 100
-            ),
-            weighted_versions AS (
-                SELECT v.*, 
-                    CASE 
-                        WHEN version LIKE '17.3%' THEN x % 4 + 4
-                        WHEN version LIKE '17.2%' THEN x % 3 + 3
-                        WHEN version LIKE '17.1%' THEN x % 2 + 2
-                        ELSE 1
-                    END as weight
-                FROM safari_versions v
-                CROSS JOIN cnt
+        return self._sample_ios(self.uniform)
+
+    def _sample_ios(self, sampler):
+        """Sample an iOS UA from the sampler's catalog snapshot"""
+        with metrics.timer('assemble'):
+            rng = self.rng
+            catalog = sampler.hints.catalog
+            
+            # Pick a device, then a Safari version that ships with it
+            device_index = sampler.ios_devices.sample(rng)
+            safari_index = sampler.safari_tables[sampler.ios_classes[device_index]].sample(rng)
+            device = catalog.ios_devices[device_index]
+            safari_version = catalog.safari_versions[safari_index]
+            
+            # Generate realistic mobile version
+            mobile_version = rng.choice(IOS_MOBILE_VERSIONS)
+            
+            # Add entropy to the WebKit version
+            webkit_version = rng.choice(IOS_WEBKIT_VERSIONS)
+            
+            # Weight the patterns (standard Safari should be most common)
+            pattern = sampler.ios_templates.sample(rng)
+            
+            app_token = None
+            if pattern == 2:
+                # App-specific (low probability)
+                app_token = (
+                    f"{rng.choice(IOS_APPS)}/"
+                    f"{rng.choice(IOS_APP_MAJORS)}.0.{rng.choice(IOS_APP_MINORS)}"
+                )
+            elif pattern == 3:
+                # Chrome iOS (low probability)
+                app_token = (
+                    f"CriOS/{rng.choice(IOS_CRIOS_MAJORS)}.0."
+                    f"{rng.choice(IOS_CRIOS_BUILDS)}.{rng.choice(IOS_CRIOS_PATCHES)}"
+                )
+            
+            return render_ios_ua(
+                ios_device_type(device[0]), device[1], safari_version[0],
+                mobile_version, webkit_version, pattern, app_token
             )
-            SELECT version, build
-            FROM weighted_versions
-            ORDER BY RANDOM()
-            LIMIT 1
-        """).fetchone()
-        
-        conn.close()
-        
-        # Generate realistic mobile version
-        mobile_versions = ['15E148', '15E148a', '15F79', '15G77', '17A844', '17B111', '17C54', '17D50']
-        mobile_version = random.choice(mobile_versions)
-        
-        # Add entropy to the WebKit version
-        webkit_versions = ['605.1.15', '605.2.15', '605.3.8', '605.4.6', '605.5.4']
-        webkit_version = random.choice(webkit_versions)
-        
-        # Base UA components
-        device_type = 'iPhone' if 'iPhone' in device[0] else 'iPad'
-        cpu_type = 'iPhone' if device_type == 'iPhone' else 'iPad'
-        os_version = device[1].replace('.', '_')
+
+class UserAgentPool:
+    """A pre-generated set of user agents handed out with rotation semantics."""
+    
+    STRATEGIES = ('round_robin', 'random', 'lru')
+    
+    def __init__(self, generator=None, size=100, device_type='both', strategy='round_robin'):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}' (choose from {', '.join(self.STRATEGIES)})")
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
         
-        # Construct UA with variations
-        ua_base = f"Mozilla/5.0 ({device_type}; CPU {cpu_type} OS {os_version} like Mac OS X)"
+        self.generator = generator or UserAgentGenerator()
+        self.device_type = device_type
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._sticky = {}
+        self._retired = set()
         
-        # Add WebKit with entropy
-        ua = f"{ua_base} AppleWebKit/{webkit_version} (KHTML, like Gecko)"
+        agents = []
+        self._members = set()
+        while len(agents) < size:
+            ua = self.generator.generate_ua(device_type)
+            if ua not in self._members:
+                self._members.add(ua)
+                agents.append(ua)
+        self._agents = agents
+        self._lru = deque(agents)
+        self._next = {
+            'round_robin': self._next_round_robin,
+            'random': self._next_random,
+            'lru': self._next_lru
+        }[strategy]
+    
+    def __len__(self):
+        return len(self._agents)
+    
+    def __contains__(self, ua):
+        return ua in self._members
+    
+    def snapshot(self):
+        """Current pool members"""
+        return list(self._agents)
+    
+    def _next_round_robin(self):
+        agents = self._agents
+        return agents[next(self._counter) % len(agents)]
+    
+    def _next_random(self):
+        return self.generator.rng.choice(self._agents)
+    
+    def _next_lru(self):
+        while True:
+            try:
+                ua = self._lru.popleft()
+            except IndexError:
+                # Every entry is momentarily checked out by other threads
+                return self._next_round_robin()
+            if ua not in self._members:
+                # Retired while queued: drop it for good
+                continue
+            self._lru.append(ua)
+            return ua
+    
+    def get(self, key=None):
+        """Check out a user agent, sticky per ``key`` when one is given"""
+        if key is None:
+            return self._next()
         
-        # Different UA patterns
-        ua_patterns = [
-            # Standard Safari
-            f"{ua} Version/{safari_version[0]} Mobile/{mobile_version} Safari/{safari_version[0]}",
+        ua = self._sticky.get(key)
+        if ua is None or ua not in self._members:
+            ua = self._next()
+            self._sticky[key] = ua
+        return ua
+    
+    def report_blocked(self, ua):
+        """Retire a user agent and replace it; returns the replacement (None if unknown)"""
+        with self._lock:
+            if ua not in self._members:
+                return None
             
-            # Safari with additional info
-            f"{ua} Version/{safari_version[0]} Mobile/{mobile_version} Safari/{safari_version[0]} {device_type}/20C65",
+            replacement = self.generator.generate_ua(self.device_type)
+            while replacement in self._members or replacement in self._retired:
+                replacement = self.generator.generate_ua(self.device_type)
             
-            # App-specific (low probability)
-            f"{ua} {self.fake.random_element(elements=('GSA','FxiOS','EdgiOS'))}/{random.randint(100, 371)}.0.{random.randint(1, 99)} Mobile/{mobile_version} Safari/{safari_version[0]}",
+            self._agents[self._agents.index(ua)] = replacement
+            self._members.add(replacement)
+            self._members.discard(ua)
+            self._retired.add(ua)
+            if self.strategy == 'lru':
+                self._lru.appendleft(replacement)
             
-            # Chrome iOS (low probability)
-            f"{ua} CriOS/{random.randint(90, 120)}.0.{random.randint(4000, 6000)}.{random.randint(80, 200)} Mobile/{mobile_version} Safari/{safari_version[0]}"
-        ]
-        
-        # Weight the patterns (standard Safari should be most common)
-        weights = [0.7, 0.2, 0.05, 0.05]
-        ua = random.choices(ua_patterns, weights=weights)[0]
-        
-        return ua
+            # Keys pinned to the blocked user agent move to the replacement
+            for key, pinned in list(self._sticky.items()):
+                if pinned == ua:
+                    self._sticky[key] = replacement
+            
+            return replacement
 
 @click.group()
 def cli():
@@ -643,10 +1383,114 @@ def cli():
 @click.option('--device', '-d', type=click.Choice(['android', 'ios', 'both']), default='both',
               help='Device type to generate user agents for')
 @click.option('--output', '-o', type=click.Path(), help='Output file path (JSON format)')
-def generate(count, device, output):
+@click.option('--unique', is_flag=True,
+              help='Draw from a keyed permutation of the UA space (distinct by construction)')
+@click.option('--seed', help='Seed for reproducible output (also keys the --unique permutation)')
+@click.option('--profile', is_flag=True, help='Print a per-stage timing breakdown when done')
+@click.option('--external', is_flag=True,
+              help='Dedup on disk for huge counts; writes one UA per line to --output')
+@click.option('--memory-budget', default='256M', help='Memory budget for --external (e.g. 512M, 2G)')
+@click.option('--headers', is_flag=True,
+              help='Also emit the matching client-hint and Accept-Language headers for each user agent')
+@click.option('--weight-profile', '-w', help='Named weight profile for catalog rows and templates')
+@click.option('--profiles-file', type=click.Path(exists=True, dir_okay=False),
+              help='JSON file of extra weight profiles ({name: profile})')
+@click.option('--shard',
+              help='Produce only shard k of N (k/N) of the --unique sequence; implies --unique, needs --seed')
+@click.option('--start', type=click.IntRange(min=0), default=0,
+              help='Position in the --unique sequence to start from (continue an earlier run with the same seed)')
+@click.option('--expect-fingerprint',
+              help='Abort unless the UA space fingerprint matches (shards must all use the same one)')
+@click.option('--manufacturer', multiple=True, help='Only these manufacturers (repeatable; iOS is Apple)')
+@click.option('--form-factor', type=click.Choice(FORM_FACTORS), help='Only phones or only tablets')
+@click.option('--min-os', help='Lowest Android/iOS version (e.g. 17.2)')
+@click.option('--max-os', help='Highest Android/iOS version (17 includes every 17.x)')
+@click.option('--chrome-version', multiple=True, help='Only these Chrome versions or prefixes (repeatable)')
+@click.option('--safari-version', multiple=True, help='Only these Safari versions or prefixes (repeatable)')
+def generate(count, device, output, unique, seed, profile, external, memory_budget, headers,
+             weight_profile, profiles_file, shard, start, expect_fingerprint, manufacturer, form_factor, min_os,
+             max_os, chrome_version, safari_version):
     """Generate user agents"""
-    generator = UserAgentGenerator()
-    user_agents = generator.generate_batch(count, device)
+    if profile:
+        metrics.enable()
+    started = time.perf_counter()
+    shard = _parse_shard(shard)
+    filters = {
+        'manufacturer': manufacturer,
+        'form_factor': form_factor,
+        'min_os_version': min_os,
+        'max_os_version': max_os,
+        'chrome_version': chrome_version,
+        'safari_version': safari_version
+    }
+    try:
+        filters = CatalogFacets.normalize(filters)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if shard:
+        if seed is None:
+            raise click.UsageError("--shard needs a --seed shared by every shard")
+        if external or headers or weight_profile or filters:
+            raise click.UsageError("--shard cannot be combined with --external, --headers, --weight-profile "
+                                   "or filters")
+        unique = True
+    if (start or expect_fingerprint) and not unique:
+        raise click.UsageError("--start and --expect-fingerprint only apply to --unique or --shard")
+    generator = UserAgentGenerator(seed=seed, shard=shard)
+    if weight_profile or filters:
+        if unique or external:
+            raise click.UsageError("--weight-profile and filters cannot be combined with --unique or --external")
+        try:
+            if profiles_file:
+                generator.load_profiles(profiles_file)
+            generator.profile_sampler(weight_profile, filters).check_device_type(device)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    if headers:
+        if unique or external:
+            raise click.UsageError("--headers cannot be combined with --unique or --external")
+        records = generator.generate_records(count, device, weight_profile, filters)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(records, f, indent=2)
+            click.echo(f"Generated {len(records)} user agents and saved to {output}")
+        else:
+            click.echo("\nGenerated User Agents:")
+            for record in records:
+                for name, value in record['headers'].items():
+                    click.echo(f"{name}: {value}")
+                click.echo("-" * 80)
+        if profile:
+            _print_profile(time.perf_counter() - started, len(records))
+        return
+    if external:
+        if not output:
+            raise click.UsageError("--external requires --output")
+        try:
+            with open(output, 'w', encoding='utf-8', buffering=1 << 20) as f:
+                written = generator.generate_batch_external(count, f, device, _parse_size(memory_budget))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Generated {written} user agents and saved to {output}")
+        if profile:
+            _print_profile(time.perf_counter() - started, written)
+        return
+    if unique:
+        fingerprint = generator.space.fingerprint
+        if expect_fingerprint and expect_fingerprint != fingerprint:
+            raise click.ClickException(
+                f"UA space fingerprint is {fingerprint}, expected {expect_fingerprint}: this catalog differs, "
+                f"so the sequence would not line up with the other shards"
+            )
+        click.echo(f"UA space size ({device}{f', shard {shard[0]}/{shard[1]}' if shard else ''}): "
+                   f"{generator.space_size(device)}, fingerprint {fingerprint}")
+        try:
+            user_agents = generator.generate_unique_batch(count, device, seed=seed, start=start)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Next --start: {start + len(user_agents)}")
+    else:
+        user_agents = generator.generate_batch(count, device, weight_profile, filters)
     
     if output:
         with open(output, 'w') as f:
@@ -657,6 +1501,43 @@ def generate(count, device, output):
         for ua in user_agents:
             click.echo(ua)
             click.echo("-" * 80)
+    
+    if profile:
+        _print_profile(time.perf_counter() - started, len(user_agents))
+
+def _parse_shard(value):
+    """Parse 'k/N' into (k, N)"""
+    if value is None:
+        return None
+    try:
+        k, n = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise click.BadParameter(f"Expected k/N, got '{value}'")
+    if not 0 <= k < n:
+        raise click.BadParameter(f"Shard {value}: need 0 <= k < N")
+    return k, n
+
+def _parse_size(value):
+    """Parse a byte size such as '512M' or '2G'"""
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    value = value.strip().upper().rstrip('B')
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise click.BadParameter(f"Invalid size: {value}")
+
+def _print_profile(elapsed, generated):
+    """Print the per-stage breakdown collected by the metrics module"""
+    click.echo(f"\nProfile: {generated} user agents in {elapsed:.3f}s")
+    click.echo(f"{'stage':<16}{'calls':>10}{'total (s)':>12}{'mean (us)':>12}{'share':>8}")
+    stages = sorted(metrics.stage_summary().items(), key=lambda item: -item[1][1])
+    for stage, (calls, total) in stages:
+        click.echo(
+            f"{stage:<16}{calls:>10}{total:>12.3f}{total / calls * 1e6:>12.1f}"
+            f"{total / elapsed * 100 if elapsed else 0:>7.1f}%"
+        )
 
 @cli.command()
 @click.option('--device', '-d', type=click.Choice(['android', 'ios', 'both']), default='both',
@@ -664,7 +1545,7 @@ def generate(count, device, output):
 def stats(device):
     """Show statistics about generated user agents"""
     generator = UserAgentGenerator()
-    conn = sqlite3.connect(generator.db_path)
+    conn = generator.connect()
     cursor = conn.cursor()
     
     if device == 'both':
@@ -694,5 +1575,408 @@ def stats(device):
         click.echo(f"First Generated: {row[2]}")
         click.echo(f"Last Generated: {row[3]}")
 
+EXPORT_COLUMNS = ('id', 'user_agent', 'device_type', 'created_at')
+COMPRESSORS = {
+    'gzip': lambda raw: gzip.GzipFile(fileobj=raw, mode='wb'),
+    'bz2': lambda raw: bz2.BZ2File(raw, mode='wb'),
+    'xz': lambda raw: lzma.LZMAFile(raw, mode='wb')
+}
+
+
+def _write_ndjson(rows, stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+    for row in rows:
+        text.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+    text.flush()
+    text.detach()
+
+
+def _write_csv(rows, stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+
+
+def _write_parquet(rows, stream, batch_size, compression):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException("Parquet export requires pyarrow (pip install pyarrow)")
+    
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('user_agent', pa.string()),
+        ('device_type', pa.string()),
+        ('created_at', pa.string())
+    ])
+    
+    with pq.ParquetWriter(stream, schema, compression=compression or 'snappy') as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_arrays(list(map(list, zip(*batch))), schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_arrays(list(map(list, zip(*batch))), schema=schema))
+
+
+def _score_chunk(lines):
+    """Process-pool task: score a chunk of user agents"""
+    return [score_user_agent(ua) for ua in lines]
+
+def _read_chunks(source, chunk_size):
+    """Yield lists of non-empty, stripped lines from a text stream"""
+    lines = (line.strip() for line in source)
+    lines = (line for line in lines if line)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+@cli.command()
+@click.argument('source', type=click.File('r', encoding='utf-8', errors='replace'), default='-')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help='Per-line results as "score<TAB>user agent" (default: stdout)')
+@click.option('--processes', '-p', type=int, default=None, help='Worker processes (default: all cores)')
+@click.option('--chunk-size', default=5000, help='User agents per worker task')
+def score(source, output, processes, chunk_size):
+    """Score user agents from a file (or stdin) with a process pool"""
+    processes = processes or os.cpu_count() or 1
+    histogram = score_histogram(())
+    total = 0
+    score_sum = 0.0
+    
+    # Keep a bounded window of chunks in flight so memory stays fixed
+    # however large the input is; results are written in input order
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        chunks = _read_chunks(source, chunk_size)
+        
+        def drain_one():
+            nonlocal total, score_sum
+            chunk, result = pending.popleft()
+            scores = result.get()
+            output.writelines(f"{value}\t{ua}\n" for value, ua in zip(scores, chunk))
+            for bucket, n in score_histogram(scores).items():
+                histogram[bucket] += n
+            total += len(scores)
+            score_sum += sum(scores)
+        
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_score_chunk, (chunk,))))
+            if len(pending) >= processes * 2:
+                drain_one()
+        while pending:
+            drain_one()
+    
+    click.echo(f"\nScored {total} user agents (mean {score_sum / total if total else 0:.1f})", err=True)
+    for bucket, n in histogram.items():
+        bar = '#' * (round(n / total * 50) if total else 0)
+        click.echo(f"{bucket:>7} {n:>10} {bar}", err=True)
+
+@cli.command()
+@click.option('--unix', 'unix_path', type=click.Path(), help='Listen on a Unix domain socket at this path')
+@click.option('--host', default='127.0.0.1', help='TCP host (ignored with --unix)')
+@click.option('--port', default=7878, help='TCP port (ignored with --unix)')
+@click.option('--max-count', default=1000, help='Largest count accepted in one request')
+@click.option('--no-save', is_flag=True, help='Do not persist served user agents')
+@click.option('--flush-interval', default=1.0, help='Seconds between background saves')
+@click.option('--seed', help='Seed for reproducible output')
+def serve(unix_path, host, port, max_count, no_save, flush_interval, seed):
+    """Serve user agents over a line protocol (Unix socket or TCP)"""
+    import asyncio
+    from ua_daemon import UserAgentDaemon
+    
+    daemon = UserAgentDaemon(
+        UserAgentGenerator(seed=seed),
+        max_count=max_count,
+        save=not no_save,
+        flush_interval=flush_interval
+    )
+    where = unix_path or f"{host}:{port}"
+    try:
+        asyncio.run(daemon.serve(
+            host, port, unix_path,
+            ready=lambda server: click.echo(f"Serving user agents on {where} (Ctrl+C to stop)")
+        ))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+def _catalog_rows(source, fmt, columns):
+    """Yield catalog tuples from a CSV (with a header row) or NDJSON stream"""
+    if fmt == 'ndjson':
+        try:
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                values = tuple(str(record.get(column) or '').strip() for column in columns)
+                if not all(values):
+                    raise click.ClickException(f"Line {line_number}: expected non-empty {', '.join(columns)}")
+                yield values
+        except (ValueError, AttributeError) as e:
+            raise click.ClickException(f"Invalid NDJSON on line {line_number}: {e}")
+        return
+    
+    reader = csv.reader(source)
+    header = [name.strip().lower() for name in next(reader, [])]
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise click.ClickException(f"CSV header is missing column(s): {', '.join(missing)}")
+    positions = [header.index(column) for column in columns]
+    
+    for row in reader:
+        try:
+            values = tuple(row[position].strip() for position in positions)
+        except IndexError:
+            values = ()
+        if len(values) != len(columns) or not all(values):
+            if not any(row):
+                continue
+            raise click.ClickException(f"Line {reader.line_num}: expected non-empty {', '.join(columns)}")
+        yield values
+
+@cli.command('import-catalog')
+@click.argument('table', type=click.Choice(list(CATALOG_COLUMNS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'csv', 'ndjson']), default='auto',
+              help='Input format (auto: from the file extension, CSV for stdin)')
+@click.option('--batch-size', default=50000, help='Rows per executemany transaction')
+def import_catalog(table, source, fmt, batch_size):
+    """Bulk-load catalog rows into ``table``; returns (rows read, rows inserted)"""
+    if fmt == 'auto':
+        fmt = 'ndjson' if source.name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+    
+    started = time.perf_counter()
+    generator = UserAgentGenerator()
+    read, inserted = generator.import_catalog(table, _catalog_rows(source, fmt, CATALOG_COLUMNS[table]), batch_size)
+    click.echo(
+        f"Imported {inserted} of {read} rows into {table} in {time.perf_counter() - started:.1f}s "
+        f"({read - inserted} duplicates skipped); {table} now holds "
+        f"{len(getattr(generator.catalog, table))} rows"
+    )
+
+@cli.command('corpus-write')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--count', '-c', default=100000, help='Number of user agents to generate')
+@click.option('--device', '-d', type=click.Choice(['android', 'ios', 'both']), default='both',
+              help='Device type to generate')
+@click.option('--unique', is_flag=True, help='Draw distinct user agents from a keyed permutation of the UA space')
+@click.option('--seed', help='Seed for reproducible output (also keys the --unique permutation)')
+@click.option('--start', type=click.IntRange(min=0), default=0,
+              help='Position in the --unique sequence to start from')
+@click.option('--input', '-i', 'source', type=click.File('r', encoding='utf-8', errors='replace'),
+              help='Encode user agents from a text file (one per line) instead of generating them')
+def corpus_write(output, count, device, unique, seed, start, source):
+    """Write a compact binary corpus (see ua_corpus.py)"""
+    from ua_corpus import CorpusWriter
+    
+    generator = UserAgentGenerator(seed=seed)
+    space = generator.space
+    skipped = 0
+    with CorpusWriter(output, space) as writer:
+        if source:
+            for line in source:
+                index = space.encode(line.strip()) if line.strip() else None
+                if index is None:
+                    skipped += line.strip() != ''
+                else:
+                    writer.write(index)
+        elif unique:
+            try:
+                writer.write_many(
+                    space.to_both(index, device)
+                    for index in space.iter_unique_indices(count, device, seed, start=start)
+                )
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        else:
+            for _ in tqdm(range(count), desc="Generating User Agents"):
+                writer.write(space.encode(generator.generate_ua(device)))
+    
+    click.echo(f"Wrote {writer.count} user agents ({writer.width} bytes each) to {output}"
+               f" ({os.path.getsize(output) / 2 ** 20:.1f} MiB)")
+    if skipped:
+        click.echo(f"Skipped {skipped} lines that are not in the UA space", err=True)
+
+@cli.command('corpus-read')
+@click.argument('corpus', type=click.Path(exists=True, dir_okay=False))
+@click.option('--start', default=0, help='First position to decode')
+@click.option('--count', '-c', type=int, help='Number of user agents to decode (default: all)')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help='Decoded user agents, one per line (default: stdout)')
+def corpus_read(corpus, start, count, output):
+    """Decode user agents from a binary corpus"""
+    from ua_corpus import Corpus
+    
+    try:
+        reader = Corpus(corpus)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    with reader:
+        stop = None if count is None else start + count
+        output.writelines(ua + '\n' for ua in reader.iter_range(start, stop))
+
+def _read_user_agents(path):
+    """Stream user agents from a corpus (.uac), a 'generate' JSON list or a text file"""
+    if path.endswith('.uac'):
+        from ua_corpus import Corpus
+        with Corpus(path) as corpus:
+            yield from corpus
+        return
+    
+    with open(path, encoding='utf-8', errors='replace') as f:
+        if path.endswith('.json'):
+            # 'generate --output' writes one JSON string per line
+            for line in f:
+                line = line.strip().rstrip(',')
+                if line.startswith('"'):
+                    yield json.loads(line)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+@cli.command('merge-shards')
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'),
+              help='Also write the merged user agents here, one per line')
+@click.option('--memory-budget', default='256M', help='Memory budget for the on-disk dedup (e.g. 512M, 2G)')
+def merge_shards(sources, output, memory_budget):
+    """Merge shard outputs and verify they are disjoint (exit status 1 if not)"""
+    examples = []
+    duplicates = 0
+    total = 0
+    
+    def on_duplicate(ua):
+        nonlocal duplicates
+        duplicates += 1
+        if len(examples) < 5:
+            examples.append(ua)
+    
+    # Size the dedup partitions: exact for corpora, ~100 bytes per line otherwise
+    expected = 1
+    fingerprints = {}
+    for source in sources:
+        if source.endswith('.uac'):
+            from ua_corpus import Corpus
+            with Corpus(source) as corpus:
+                expected += len(corpus)
+                fingerprints[source] = corpus.space.fingerprint
+        else:
+            expected += os.path.getsize(source) // 100
+    if len(set(fingerprints.values())) > 1:
+        for source, fingerprint in fingerprints.items():
+            click.echo(f"  {fingerprint}  {source}", err=True)
+        raise click.ClickException("Corpora were built from different UA spaces, so their shards cannot line up")
+    
+    try:
+        dedup = DiskDedup(expected, _parse_size(memory_budget))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    with dedup:
+        for source in sources:
+            for ua in tqdm(_read_user_agents(source), desc=os.path.basename(source)):
+                dedup.add(ua)
+                total += 1
+        
+        unique = 0
+        for ua in dedup.drain(on_duplicate=on_duplicate):
+            unique += 1
+            if output:
+                output.write(ua + '\n')
+    
+    click.echo(f"Read {total} user agents from {len(sources)} files: {unique} distinct, {duplicates} duplicates")
+    if duplicates:
+        for ua in examples:
+            click.echo(f"  duplicate: {ua}", err=True)
+        raise SystemExit(1)
+    click.echo("Shards are disjoint")
+
+@cli.command()
+@click.option('--db', 'db_path', default='useragents.db', envvar='UA_DB_PATH', type=click.Path(),
+              help='Database to upgrade (default: $UA_DB_PATH or useragents.db)')
+def migrate(db_path):
+    """Upgrade an older database in place (stop the service first)"""
+    if not os.path.exists(db_path):
+        raise click.ClickException(f"{db_path} does not exist")
+    if UserAgentGenerator.migrate_database(db_path):
+        click.echo(f"Rebuilt generated_agents in {db_path} around ua_hash")
+    else:
+        click.echo(f"{db_path} is up to date")
+
+@cli.command()
+@click.option('--older-than', type=int, help='Archive agents older than this many days')
+@click.option('--to', 'archive_path', type=click.Path(),
+              help='Archive target: .gz for compressed NDJSON, anything else for an SQLite database. '
+                   'Rows are deleted without a copy when omitted')
+@click.option('--convert', is_flag=True,
+              help='First switch the database to incremental auto-vacuum (one-off full VACUUM; '
+                   'stop other writers first)')
+def archive(older_than, archive_path, convert):
+    """Apply retention to generated user agents"""
+    if older_than is None and not convert:
+        raise click.UsageError("Give --older-than, --convert or both")
+    generator = UserAgentGenerator()
+    if convert:
+        if generator.incremental_vacuum_enabled():
+            click.echo("Database already uses incremental auto-vacuum")
+        else:
+            generator.convert_to_incremental_vacuum()
+            click.echo("Converted the database to incremental auto-vacuum")
+    if older_than is None:
+        return
+    removed = generator.archive_generated_agents(older_than, archive_path)
+    click.echo(f"Archived {removed} user agents" + (f" to {archive_path}" if archive_path else ""))
+    if removed and not generator.incremental_vacuum_enabled():
+        click.echo("Freed pages stay in the file until you run 'archive --convert' once")
+
+@cli.command()
+@click.option('--output', '-o', default='-', type=click.Path(allow_dash=True),
+              help='Output file path (default: stdout)')
+@click.option('--format', '-f', 'fmt', type=click.Choice(['ndjson', 'csv', 'parquet']), default='ndjson',
+              help='Output format')
+@click.option('--device', '-d', type=click.Choice(['android', 'ios', 'both']), default='both',
+              help='Device type to export')
+@click.option('--since', type=click.DateTime(), help='Only export agents created at or after this time')
+@click.option('--until', type=click.DateTime(), help='Only export agents created before this time')
+@click.option('--compress', type=click.Choice(['none', 'gzip', 'bz2', 'xz']), default='none',
+              help='Compression (parquet supports gzip only, applied per column chunk)')
+@click.option('--batch-size', default=10000, help='Rows fetched per page')
+def export(output, fmt, device, since, until, compress, batch_size):
+    """Stream generated user agents to NDJSON, CSV or Parquet"""
+    generator = UserAgentGenerator()
+    rows = generator.iter_generated_agents(
+        device_type=None if device == 'both' else device,
+        since=since.isoformat() if since else None,
+        until=until.isoformat() if until else None,
+        batch_size=batch_size
+    )
+    
+    if fmt == 'parquet' and compress not in ('none', 'gzip'):
+        raise click.ClickException("Parquet export supports --compress gzip only")
+    
+    with click.open_file(output, 'wb') as raw:
+        if fmt == 'parquet':
+            _write_parquet(rows, raw, batch_size, 'gzip' if compress == 'gzip' else None)
+            return
+        
+        stream = COMPRESSORS[compress](raw) if compress != 'none' else raw
+        try:
+            if fmt == 'ndjson':
+                _write_ndjson(rows, stream)
+            else:
+                _write_csv(rows, stream)
+        finally:
+            if stream is not raw:
+                stream.close()
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import pyperclip
 from ua_generator import UserAgentGenerator
-import random
+import queue
+import threading
+
+# Number of ready-to-show user agents kept ahead of the UI
+PREFETCH_SIZE = 4
+
+# Regeneration attempts before settling for the best-scoring candidate (same as /api/generate)
+MAX_ATTEMPTS = 5
+
+# Bulk export: user agents generated and saved per batch, largest count, progress poll interval (ms)
+BULK_BATCH_SIZE = 1000
+MAX_BULK_COUNT = 1000000
+BULK_POLL_MS = 100
+
+# Interval (ms) at which the Tk thread picks up errors reported by the generation worker
+WORKER_POLL_MS = 200
 
 class UserAgentGeneratorUI:
     def __init__(self, root):
         self.root = root
         self.root.title("User Agent Generator")
-        self.root.geometry("800x400")
+        self.root.geometry("800x520")
         self.root.resizable(True, True)
         
         # Initialize the generator
@@ -32,11 +47,11 @@ class UserAgentGeneratorUI:
         
         self.device_type = tk.StringVar(value="both")
         ttk.Radiobutton(self.device_frame, text="Both", variable=self.device_type, 
-                       value="both").grid(row=0, column=0, padx=5)
+                       value="both", command=self.on_device_change).grid(row=0, column=0, padx=5)
         ttk.Radiobutton(self.device_frame, text="Android", variable=self.device_type,
-                       value="android").grid(row=0, column=1, padx=5)
+                       value="android", command=self.on_device_change).grid(row=0, column=1, padx=5)
         ttk.Radiobutton(self.device_frame, text="iOS", variable=self.device_type,
-                       value="ios").grid(row=0, column=2, padx=5)
+                       value="ios", command=self.on_device_change).grid(row=0, column=2, padx=5)
         
         # User Agent Display
         self.ua_frame = ttk.LabelFrame(self.main_frame, text="Generated User Agent", padding="5")
@@ -73,69 +88,252 @@ class UserAgentGeneratorUI:
                                   command=self.copy_ua, style="Copy.TButton")
         self.copy_btn.grid(row=0, column=1, padx=5)
         
+        # Bulk generation: many user agents straight to a file, in the background
+        self.bulk_frame = ttk.LabelFrame(self.main_frame, text="Bulk Generate", padding="5")
+        self.bulk_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        self.bulk_frame.columnconfigure(4, weight=1)
+        
+        ttk.Label(self.bulk_frame, text="Count:").grid(row=0, column=0, padx=5)
+        self.bulk_count = tk.StringVar(value="1000")
+        ttk.Spinbox(self.bulk_frame, from_=1, to=MAX_BULK_COUNT, increment=1000, width=10,
+                    textvariable=self.bulk_count).grid(row=0, column=1, padx=5)
+        
+        self.bulk_btn = ttk.Button(self.bulk_frame, text="Generate to File...", command=self.start_bulk)
+        self.bulk_btn.grid(row=0, column=2, padx=5)
+        
+        self.cancel_btn = ttk.Button(self.bulk_frame, text="Cancel", command=self.cancel_bulk, state='disabled')
+        self.cancel_btn.grid(row=0, column=3, padx=5)
+        
+        self.bulk_progress = ttk.Progressbar(self.bulk_frame, mode='determinate')
+        self.bulk_progress.grid(row=0, column=4, sticky=(tk.W, tk.E), padx=5)
+        
         # Status bar
         self.status_var = tk.StringVar()
         self.status_bar = ttk.Label(self.main_frame, textvariable=self.status_var)
-        self.status_bar.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        self.status_bar.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        
+        # Background generation: a worker keeps a small queue of high-entropy
+        # user agents ready and persists the ones that get shown
+        self.wanted_device = self.device_type.get()
+        self.prefetch = queue.Queue(maxsize=PREFETCH_SIZE)
+        self.to_save = queue.Queue()
+        self.stopping = threading.Event()
+        self.waiting = False
+        self.worker_errors = queue.Queue()  # status messages, shown by _poll_worker on the Tk thread
+        self.worker = threading.Thread(target=self._generation_worker, daemon=True)
+        self.worker.start()
+        
+        # Bulk jobs report (done, total, error) through a queue polled from the Tk thread
+        self.bulk_worker = None
+        self.bulk_cancel = threading.Event()
+        self.bulk_events = queue.Queue()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Initialize with first user agent
         self.generate_ua()
+        self.root.after(WORKER_POLL_MS, self._poll_worker)
     
-    def generate_ua(self):
-        """Generate a new unique user agent"""
-        device_type = self.device_type.get()
-        
-        try:
-            if device_type == 'android':
-                ua = self.generator.generate_android_ua()
-            elif device_type == 'ios':
-                ua = self.generator.generate_ios_ua()
-            else:
-                ua = self.generator.generate_android_ua() if random.random() < 0.5 else self.generator.generate_ios_ua()
-            
-            # Save to database and update UI
-            self.generator.save_generated_ua(ua, 'android' if 'Android' in ua else 'ios')
-            
-            # Calculate entropy score and regenerate if too low
-            max_attempts = 5
-            attempts = 0
-            while attempts < max_attempts:
-                entropy_score = self.generator.calculate_entropy_score(ua)
-                if entropy_score >= 90:
-                    break
-                ua = self.generator.generate_android_ua() if device_type == 'android' else self.generator.generate_ios_ua() if device_type == 'ios' else (
-                    self.generator.generate_android_ua() if random.random() < 0.5 else self.generator.generate_ios_ua()
-                )
-                attempts += 1
-            
+    def _next_candidate(self, device_type):
+        """Generate one user agent, retrying until it scores 90+ (worker thread)"""
+        best_ua, best_score = None, -1
+        for _ in range(MAX_ATTEMPTS):
+            ua = self.generator.generate_ua(device_type)
+            entropy_score = self.generator.calculate_entropy_score(ua)
+            if entropy_score > best_score:
+                best_ua, best_score = ua, entropy_score
             if entropy_score >= 90:
-                # Update UA text
-                self.ua_text.config(state='normal')
-                self.ua_text.delete(1.0, tk.END)
-                self.ua_text.insert(tk.END, ua)
-                self.ua_text.config(state='disabled')
-                
-                # Update entropy score with color (only green since we filter for 90+)
-                self.entropy_label.config(text=f"{entropy_score}%", foreground='#00aa00')
-            else:
-                # Try again if entropy is too low
-                self.generate_ua()
+                break
+        return best_ua, best_score
+    
+    def _generation_worker(self):
+        """Fill the prefetch queue and save shown user agents off the Tk thread"""
+        pending = None
+        while not self.stopping.is_set():
+            # Persist everything the UI has displayed since the last pass
+            shown = []
+            while True:
+                try:
+                    shown.append(self.to_save.get_nowait())
+                except queue.Empty:
+                    break
+            if shown:
+                try:
+                    self.generator.save_generated_uas(shown)
+                except Exception as e:
+                    self.worker_errors.put(f"Failed to save user agents: {e}")
             
-            self.status_var.set("New user agent generated successfully!")
+            if pending is None:
+                device_type = self.wanted_device
+                try:
+                    ua, entropy_score = self._next_candidate(device_type)
+                except Exception as e:
+                    self.worker_errors.put(f"Error generating user agent: {e}")
+                    self.stopping.wait(1)
+                    continue
+                pending = (device_type, ua, entropy_score)
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate user agent: {str(e)}")
-            self.status_var.set("Error generating user agent!")
+            try:
+                self.prefetch.put(pending, timeout=0.1)
+                pending = None
+            except queue.Full:
+                pass
+    
+    def _poll_worker(self):
+        """Show errors reported by the generation worker; reschedules itself until close"""
+        while True:
+            try:
+                self.status_var.set(self.worker_errors.get_nowait())
+            except queue.Empty:
+                break
+        if not self.stopping.is_set():
+            self.root.after(WORKER_POLL_MS, self._poll_worker)
+    
+    def on_device_change(self):
+        """Drop prefetched user agents for the previous device type"""
+        self.wanted_device = self.device_type.get()
+        while True:
+            try:
+                self.prefetch.get_nowait()
+            except queue.Empty:
+                break
+        self.generate_ua()
+    
+    def generate_ua(self):
+        """Show the next prefetched user agent (never blocks the Tk thread)"""
+        device_type = self.device_type.get()
+        
+        while True:
+            try:
+                item_device, ua, entropy_score = self.prefetch.get_nowait()
+            except queue.Empty:
+                # Nothing ready yet: poll again shortly instead of blocking
+                self.status_var.set("Generating user agent...")
+                if not self.waiting:
+                    self.waiting = True
+                    self.root.after(50, self._retry_generate)
+                return
+            if item_device == device_type:
+                break
+        
+        # Update UA text
+        self.ua_text.config(state='normal')
+        self.ua_text.delete(1.0, tk.END)
+        self.ua_text.insert(tk.END, ua)
+        self.ua_text.config(state='disabled')
+        
+        # Update entropy score with color
+        color = '#00aa00' if entropy_score >= 90 else '#cc8800'
+        self.entropy_label.config(text=f"{entropy_score}%", foreground=color)
+        
+        self.to_save.put((ua, 'android' if 'Android' in ua else 'ios'))
+        self.status_var.set("New user agent generated successfully!")
+    
+    def _retry_generate(self):
+        self.waiting = False
+        self.generate_ua()
     
     def copy_ua(self):
         """Copy the current user agent to clipboard"""
         ua = self.ua_text.get(1.0, tk.END).strip()
         if ua:
             pyperclip.copy(ua)
+            self.generate_ua()  # Show the next prefetched one right away
             self.status_var.set("User agent copied to clipboard!")
-            self.generate_ua()  # Generate new one automatically after copying
         else:
             self.status_var.set("No user agent to copy!")
+    
+    def start_bulk(self):
+        """Ask for a file and start a background bulk job"""
+        try:
+            count = int(self.bulk_count.get())
+        except ValueError:
+            count = 0
+        if not 1 <= count <= MAX_BULK_COUNT:
+            messagebox.showerror("Bulk Generate", f"Count must be between 1 and {MAX_BULK_COUNT}")
+            return
+        
+        path = filedialog.asksaveasfilename(
+            title="Save user agents", defaultextension=".txt",
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        
+        self.bulk_cancel.clear()
+        self.bulk_progress.config(maximum=count, value=0)
+        self.bulk_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.status_var.set(f"Generating {count} user agents...")
+        self.bulk_worker = threading.Thread(
+            target=self._bulk_worker, args=(count, self.device_type.get(), path), daemon=True
+        )
+        self.bulk_worker.start()
+        self.root.after(BULK_POLL_MS, self._poll_bulk)
+    
+    def _bulk_worker(self, count, device_type, path):
+        """Generate, save and write user agents batch by batch (worker thread)"""
+        done = 0
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for batch in self.generator.iter_batches(count, device_type, BULK_BATCH_SIZE):
+                    f.write('\n'.join(batch) + '\n')
+                    done += len(batch)
+                    self.bulk_events.put((done, count, path, None))
+                    if self.bulk_cancel.is_set():
+                        break
+        except Exception as e:
+            self.bulk_events.put((done, count, path, e))
+            return
+        self.bulk_events.put((done, count, path, 'finished'))
+    
+    def _poll_bulk(self):
+        """Apply progress reported by the bulk worker; reschedules itself until the job ends"""
+        finished = False
+        while True:
+            try:
+                done, count, path, outcome = self.bulk_events.get_nowait()
+            except queue.Empty:
+                break
+            self.bulk_progress.config(value=done)
+            if outcome is None:
+                self.status_var.set(f"Generated {done} of {count} user agents...")
+                continue
+            finished = True
+            if outcome != 'finished':
+                self.status_var.set(f"Bulk generation failed after {done} user agents: {outcome}")
+            elif done < count:
+                self.status_var.set(f"Cancelled: {done} user agents written to {path}")
+            else:
+                self.status_var.set(f"Generated {done} user agents and saved to {path}")
+        
+        if finished:
+            self.bulk_btn.config(state='normal')
+            self.cancel_btn.config(state='disabled')
+        else:
+            self.root.after(BULK_POLL_MS, self._poll_bulk)
+    
+    def cancel_bulk(self):
+        """Stop the bulk job after its current batch"""
+        self.bulk_cancel.set()
+        self.cancel_btn.config(state='disabled')
+        self.status_var.set("Cancelling...")
+    
+    def on_close(self):
+        """Stop the workers, flush pending saves and close the window"""
+        self.stopping.set()
+        self.bulk_cancel.set()
+        self.worker.join(timeout=2)
+        if self.bulk_worker is not None:
+            self.bulk_worker.join(timeout=2)
+        shown = []
+        while True:
+            try:
+                shown.append(self.to_save.get_nowait())
+            except queue.Empty:
+                break
+        if shown:
+            self.generator.save_generated_uas(shown)
+        self.root.destroy()
 
 def main():
     root = tk.Tk()
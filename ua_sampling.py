@@ -0,0 +1,1091 @@
+"""Catalog samplers, the UA index space and on-disk dedup used by ua_generator."""
+import bisect
+import copy
+import hashlib
+import itertools
+import json
+import math
+import operator
+import os
+import re
+import shutil
+import string
+import tempfile
+
+
+# Components used to decorate Android user agents
+ANDROID_BUILD_PREFIXES = ('QP', 'RP', 'SP', 'TP')
+ANDROID_BUILD_LETTERS = string.ascii_letters
+ANDROID_BUILD_NUMBERS = 10 ** 6
+ANDROID_WEBKIT_MINORS = (34, 35, 36)
+ANDROID_EXTRA_TAGS = (
+    " EdgA/1.0",
+    " GoogleApp/13.47.8.23",
+    " Chrome/96.0.4664.104 Mobile Safari/537.36",
+    " Mobile"
+)
+
+# Components used to decorate iOS user agents
+IOS_MOBILE_VERSIONS = ('15E148', '15E148a', '15F79', '15G77', '17A844', '17B111', '17C54', '17D50')
+IOS_WEBKIT_VERSIONS = ('605.1.15', '605.2.15', '605.3.8', '605.4.6', '605.5.4')
+IOS_APPS = ('GSA', 'FxiOS', 'EdgiOS')
+IOS_APP_MAJORS = range(100, 372)
+IOS_APP_MINORS = range(1, 100)
+IOS_CRIOS_MAJORS = range(90, 121)
+IOS_CRIOS_BUILDS = range(4000, 6001)
+IOS_CRIOS_PATCHES = range(80, 201)
+
+# iOS UA patterns: standard Safari, Safari with device info, in-app browser, Chrome iOS
+IOS_PATTERN_WEIGHTS = [0.7, 0.2, 0.05, 0.05]
+
+# Share of Android user agents that get one of ANDROID_EXTRA_TAGS
+ANDROID_EXTRA_TAG_RATE = 0.1
+
+# Parsers for rendered user agents (see UserAgentSpace.encode)
+ANDROID_UA_PATTERN = re.compile(
+    r"Mozilla/5\.0 \(Linux; (Android .*?)(?:; (wv|(?:Build/)?[A-Z]{2}[A-Za-z]\d+))?\) "
+    r"AppleWebKit/537\.(\d+) \(KHTML, like Gecko\) Chrome/(\S+) Mobile Safari/537\.\3(.*)"
+)
+IOS_UA_PATTERN = re.compile(
+    r"Mozilla/5\.0 \((iPhone|iPad); CPU \1 OS (\S+) like Mac OS X\) AppleWebKit/(\S+) \(KHTML, like Gecko\) "
+    r"(?:Version/(\S+) Mobile/(\S+) Safari/\4( \1/20C65)?|(\S+) Mobile/(\S+) Safari/(\S+))"
+)
+
+# Template names used by weight profiles, in the order the samplers index them
+ANDROID_TEMPLATES = ('wv', 'build', 'bare', 'none')
+IOS_TEMPLATES = ('safari', 'safari_device', 'app', 'crios')
+
+# Android blocks of UserAgentSpace: (build tag template, has an extra tag)
+ANDROID_STRATA = tuple((template, extra) for template in ANDROID_TEMPLATES for extra in (False, True))
+
+# Weight profile fields: {field: {key: weight}}; versions match on whole components
+PROFILE_FIELDS = (
+    'manufacturers', 'android_versions', 'ios_versions', 'chrome_versions', 'safari_versions', 'templates'
+)
+
+# Sampling filters (see CatalogFacets); version filters match on whole components
+FILTER_FIELDS = (
+    'manufacturer', 'form_factor', 'min_os_version', 'max_os_version', 'chrome_version', 'safari_version'
+)
+FORM_FACTORS = ('phone', 'tablet')
+
+# Android models treated as tablets by the form_factor filter
+ANDROID_TABLET_PATTERN = re.compile(r'\b(?:Tab|Tablet|Pad)\b')
+
+# Oldest Android release each Chrome major runs on, newest cut-off first
+CHROME_ANDROID_FLOORS = ((120, '8.0'), (107, '7.0'))
+
+# Safari builds with this many components are the catalog's iPad-only builds
+IPAD_SAFARI_BUILD_COMPONENTS = 6
+
+# GREASE brands rotated by Chrome major version in Sec-CH-UA
+CH_UA_GREASE = (('Not_A Brand', '8'), ('Not A(Brand', '99'), ('Not/A)Brand', '24'), ('Not)A;Brand', '99'))
+
+# Sec-CH-UA brand for each Android browser flavour
+CH_UA_BRANDS = {'chrome': 'Google Chrome', 'webview': 'Android WebView', 'edge': 'Microsoft Edge'}
+
+def render_android_ua(device, chrome_version, webkit_minor, build_tag='', extra_tag=''):
+    """Assemble an Android user agent from its components"""
+    webkit_version = f"537.{webkit_minor}"
+    
+    # Base UA string
+    ua = (
+        f"Mozilla/5.0 (Linux; Android {device[2]}; "
+        f"{device[0]} {device[1]}"
+    )
+    
+    # Add build tag if selected
+    if build_tag:
+        ua += f"; {build_tag}"
+    
+    # Complete UA string
+    ua += (
+        f") AppleWebKit/{webkit_version} (KHTML, like Gecko) "
+        f"Chrome/{chrome_version} Mobile Safari/{webkit_version}"
+    )
+    
+    return ua + extra_tag
+
+
+def render_ios_ua(device_type, ios_version, safari_version, mobile_version, webkit_version,
+                  pattern=0, app_token=None):
+    """Assemble an iOS user agent from its components"""
+    os_version = ios_version.replace('.', '_')
+    ua = (
+        f"Mozilla/5.0 ({device_type}; CPU {device_type} OS {os_version} like Mac OS X) "
+        f"AppleWebKit/{webkit_version} (KHTML, like Gecko)"
+    )
+    
+    if pattern == 0:
+        # Standard Safari
+        return f"{ua} Version/{safari_version} Mobile/{mobile_version} Safari/{safari_version}"
+    if pattern == 1:
+        # Safari with additional info
+        return f"{ua} Version/{safari_version} Mobile/{mobile_version} Safari/{safari_version} {device_type}/20C65"
+    
+    # App-specific or Chrome iOS
+    return f"{ua} {app_token} Mobile/{mobile_version} Safari/{safari_version}"
+
+
+def ios_device_type(model):
+    """Return the UA device token ('iPhone' or 'iPad') for an iOS model name"""
+    return 'iPhone' if 'iPhone' in model else 'iPad'
+
+
+class UserAgentSpace:
+    """Index over every distinct user agent the generator can produce, in per-template strata."""
+    
+    BUILD_IDS = len(ANDROID_BUILD_PREFIXES) * len(ANDROID_BUILD_LETTERS) * ANDROID_BUILD_NUMBERS
+    APP_TOKENS = len(IOS_APPS) * len(IOS_APP_MAJORS) * len(IOS_APP_MINORS)
+    CRIOS_TOKENS = len(IOS_CRIOS_MAJORS) * len(IOS_CRIOS_BUILDS) * len(IOS_CRIOS_PATCHES)
+    
+    def __init__(self, android_devices, chrome_versions, ios_platforms, android_classes):
+        self.android_devices = tuple(android_devices)
+        self.chrome_versions = tuple(chrome_versions)
+        self.ios_platforms = tuple(ios_platforms)
+        # (device count, compatible chrome_versions indices) per run of android_devices
+        self.android_classes = tuple((count, tuple(chromes)) for count, chromes in android_classes)
+        self._device_starts = [0]
+        self._pair_starts = [0]
+        for count, chromes in self.android_classes:
+            self._device_starts.append(self._device_starts[-1] + count)
+            self._pair_starts.append(self._pair_starts[-1] + count * len(chromes))
+        
+        # One mixed-radix block per ANDROID_STRATA / IOS_TEMPLATES entry, laid out back to back
+        pairs = self._pair_starts[-1]
+        self.android_radices = tuple(
+            (pairs, len(ANDROID_WEBKIT_MINORS))
+            + ((self.BUILD_IDS,) if template in ('build', 'bare') else ())
+            + ((len(ANDROID_EXTRA_TAGS),) if extra else ())
+            for template, extra in ANDROID_STRATA
+        )
+        ios_tokens = (1, 1, self.APP_TOKENS, self.CRIOS_TOKENS)
+        self.ios_radices = tuple(
+            (len(self.ios_platforms), len(IOS_MOBILE_VERSIONS), len(IOS_WEBKIT_VERSIONS))
+            + ((tokens,) if tokens > 1 else ())
+            for tokens in ios_tokens
+        )
+        self.android_starts = list(itertools.accumulate((_product(r) for r in self.android_radices), initial=0))
+        self.ios_starts = list(itertools.accumulate((_product(r) for r in self.ios_radices), initial=0))
+        self.android_size = self.android_starts[-1]
+        self.ios_size = self.ios_starts[-1]
+        self._lookups = None
+        self._fingerprint = None
+    
+    @classmethod
+    def from_catalog(cls, catalog, compat=None):
+        """Build the space from a Catalog snapshot, pairing only compatible browsers"""
+        compat = compat or CompatibilityIndex(catalog)
+        # Rows like ('Google', 'Pixel 8', ...) and ('Google Pixel', '8', ...) render alike: keep the first
+        rendered = {}
+        for row, (manufacturer, model, version) in enumerate(catalog.android_devices):
+            rendered.setdefault(f"Android {version}; {manufacturer} {model}", row)
+        chrome_versions = _unique(version for version, build in catalog.chrome_versions)
+        chrome_indices = {version: i for i, version in reversed(list(enumerate(chrome_versions)))}
+        
+        classes = {}
+        for row in rendered.values():
+            classes.setdefault(compat.android_classes[row], []).append(catalog.android_devices[row])
+        android_devices = []
+        android_classes = []
+        for class_id, devices in classes.items():
+            chromes = _unique(chrome_indices[catalog.chrome_versions[row][0]] for row in compat.chrome_rows[class_id])
+            if chromes:
+                android_devices.extend(devices)
+                android_classes.append((len(devices), chromes))
+        
+        ios_platforms = _unique(
+            (ios_device_type(model), ios_version, catalog.safari_versions[row][0])
+            for (model, ios_version), class_id in zip(catalog.ios_devices, compat.ios_classes)
+            for row in compat.safari_rows[class_id]
+        )
+        return cls(android_devices, chrome_versions, ios_platforms, android_classes)
+    
+    @property
+    def fingerprint(self):
+        """Short hash of the dictionary and radices: equal fingerprints mean equal index layouts"""
+        if self._fingerprint is None:
+            canonical = json.dumps([
+                self.android_devices, self.android_classes, self.chrome_versions, self.ios_platforms,
+                self.android_radices, self.ios_radices,
+                [ANDROID_BUILD_PREFIXES, ANDROID_BUILD_LETTERS, ANDROID_BUILD_NUMBERS, ANDROID_WEBKIT_MINORS,
+                 ANDROID_EXTRA_TAGS, IOS_MOBILE_VERSIONS, IOS_WEBKIT_VERSIONS, IOS_APPS],
+                [[values.start, values.stop] for values in (
+                    IOS_APP_MAJORS, IOS_APP_MINORS, IOS_CRIOS_MAJORS, IOS_CRIOS_BUILDS, IOS_CRIOS_PATCHES
+                )]
+            ], separators=(',', ':'))
+            self._fingerprint = hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+        return self._fingerprint
+    
+    def size(self, device_type='both'):
+        """Number of distinct user agents reachable for a device type"""
+        if device_type == 'android':
+            return self.android_size
+        if device_type == 'ios':
+            return self.ios_size
+        return self.android_size + self.ios_size
+    
+    def strata(self, device_type='both'):
+        """(label, first index, size, share of normal generation) per stratum of a device type's space"""
+        android = [
+            (f"android:{template}{'+extra' if extra else ''}", start, end - start,
+             (ANDROID_EXTRA_TAG_RATE if extra else 1 - ANDROID_EXTRA_TAG_RATE) / len(ANDROID_TEMPLATES))
+            for (template, extra), start, end in zip(ANDROID_STRATA, self.android_starts, self.android_starts[1:])
+        ]
+        ios = [
+            (f"ios:{template}", start, end - start, weight)
+            for template, weight, start, end in zip(IOS_TEMPLATES, IOS_PATTERN_WEIGHTS, self.ios_starts,
+                                                    self.ios_starts[1:])
+        ]
+        if device_type == 'android':
+            return android
+        if device_type == 'ios':
+            return ios
+        return [(label, start, size, weight / 2) for label, start, size, weight in android] + [
+            (label, self.android_size + start, size, weight / 2) for label, start, size, weight in ios
+        ]
+    
+    def render_android(self, index):
+        """Render the Android user agent at ``index``"""
+        stratum = bisect.bisect_right(self.android_starts, index) - 1
+        template, extra = ANDROID_STRATA[stratum]
+        pair, webkit, *decorations = _split(index - self.android_starts[stratum], self.android_radices[stratum])
+        device, chrome = self._android_pair(pair)
+        
+        if template == 'wv':
+            build_tag = "wv"
+        elif template == 'none':
+            build_tag = ""
+        else:
+            rest, number = divmod(decorations.pop(0), ANDROID_BUILD_NUMBERS)
+            prefix, letter = divmod(rest, len(ANDROID_BUILD_LETTERS))
+            build_id = f"{ANDROID_BUILD_PREFIXES[prefix]}{ANDROID_BUILD_LETTERS[letter]}{number}"
+            build_tag = f"Build/{build_id}" if template == 'build' else build_id
+        
+        return render_android_ua(
+            self.android_devices[device],
+            self.chrome_versions[chrome],
+            ANDROID_WEBKIT_MINORS[webkit],
+            build_tag,
+            ANDROID_EXTRA_TAGS[decorations[0]] if extra else ''
+        )
+    
+    def _android_pair(self, pair):
+        """(android_devices index, chrome_versions index) of a pair digit"""
+        group = bisect.bisect_right(self._pair_starts, pair) - 1
+        _, chromes = self.android_classes[group]
+        device, chrome = divmod(pair - self._pair_starts[group], len(chromes))
+        return self._device_starts[group] + device, chromes[chrome]
+    
+    def render_ios(self, index):
+        """Render the iOS user agent at ``index``"""
+        pattern = bisect.bisect_right(self.ios_starts, index) - 1
+        platform, mobile, webkit, *token = _split(index - self.ios_starts[pattern], self.ios_radices[pattern])
+        device_type, ios_version, safari_version = self.ios_platforms[platform]
+        
+        app_token = None
+        if pattern == 3:
+            rest, patch = divmod(token[0], len(IOS_CRIOS_PATCHES))
+            major, build = divmod(rest, len(IOS_CRIOS_BUILDS))
+            app_token = (
+                f"CriOS/{IOS_CRIOS_MAJORS[major]}.0.{IOS_CRIOS_BUILDS[build]}.{IOS_CRIOS_PATCHES[patch]}"
+            )
+        elif pattern == 2:
+            rest, minor = divmod(token[0], len(IOS_APP_MINORS))
+            app, major = divmod(rest, len(IOS_APP_MAJORS))
+            app_token = f"{IOS_APPS[app]}/{IOS_APP_MAJORS[major]}.0.{IOS_APP_MINORS[minor]}"
+        
+        return render_ios_ua(
+            device_type, ios_version, safari_version,
+            IOS_MOBILE_VERSIONS[mobile], IOS_WEBKIT_VERSIONS[webkit],
+            pattern, app_token
+        )
+    
+    def render(self, index, device_type='both'):
+        """Render the user agent at ``index`` of the given device type's space"""
+        if device_type == 'android':
+            return self.render_android(index)
+        if device_type == 'ios':
+            return self.render_ios(index)
+        if index < self.android_size:
+            return self.render_android(index)
+        return self.render_ios(index - self.android_size)
+    
+    def encode(self, ua):
+        """Return the 'both' index that renders to ``ua``, or None if it is not in the space"""
+        if self._lookups is None:
+            self._lookups = (
+                {f"Android {v}; {manufacturer} {model}": i
+                 for i, (manufacturer, model, v) in reversed(list(enumerate(self.android_devices)))},
+                {version: i for i, version in reversed(list(enumerate(self.chrome_versions)))},
+                {platform: i for i, platform in reversed(list(enumerate(self.ios_platforms)))},
+                [{chrome: i for i, chrome in enumerate(chromes)} for _, chromes in self.android_classes]
+            )
+        devices, chrome_versions, platforms, class_chromes = self._lookups
+        
+        try:
+            match = ANDROID_UA_PATTERN.fullmatch(ua)
+            if match:
+                device_text, tag_text, webkit, chrome, extra = match.groups()
+                device = devices[device_text]
+                group = bisect.bisect_right(self._device_starts, device) - 1
+                pair = self._pair_starts[group] + (
+                    (device - self._device_starts[group]) * len(self.android_classes[group][1])
+                    + class_chromes[group][chrome_versions[chrome]]
+                )
+                digits = [pair, ANDROID_WEBKIT_MINORS.index(int(webkit))]
+                if tag_text is None:
+                    template = 'none'
+                elif tag_text == 'wv':
+                    template = 'wv'
+                else:
+                    template = 'build' if tag_text.startswith('Build/') else 'bare'
+                    build_id = tag_text[6:] if template == 'build' else tag_text
+                    digits.append(
+                        (ANDROID_BUILD_PREFIXES.index(build_id[:2]) * len(ANDROID_BUILD_LETTERS)
+                         + ANDROID_BUILD_LETTERS.index(build_id[2])) * ANDROID_BUILD_NUMBERS
+                        + int(build_id[3:])
+                    )
+                if extra:
+                    digits.append(ANDROID_EXTRA_TAGS.index(extra))
+                stratum = ANDROID_STRATA.index((template, bool(extra)))
+                index = self.android_starts[stratum] + _join(digits, self.android_radices[stratum])
+                return index if self.render_android(index) == ua else None
+            
+            match = IOS_UA_PATTERN.fullmatch(ua)
+            if match:
+                device_type, os_version, webkit, safari, mobile, device_info, app_token, app_mobile, app_safari = \
+                    match.groups()
+                token = []
+                if app_token is None:
+                    pattern = 1 if device_info else 0
+                else:
+                    safari, mobile = app_safari, app_mobile
+                    name, _, version = app_token.partition('/')
+                    major, zero, *rest = version.split('.')
+                    if name == 'CriOS':
+                        build, patch = rest
+                        pattern = 3
+                        token.append(
+                            (IOS_CRIOS_MAJORS.index(int(major)) * len(IOS_CRIOS_BUILDS)
+                             + IOS_CRIOS_BUILDS.index(int(build))) * len(IOS_CRIOS_PATCHES)
+                            + IOS_CRIOS_PATCHES.index(int(patch))
+                        )
+                    else:
+                        minor, = rest
+                        pattern = 2
+                        token.append(
+                            (IOS_APPS.index(name) * len(IOS_APP_MAJORS)
+                             + IOS_APP_MAJORS.index(int(major))) * len(IOS_APP_MINORS)
+                            + IOS_APP_MINORS.index(int(minor))
+                        )
+                platform = platforms[(device_type, os_version.replace('_', '.'), safari)]
+                index = self.ios_starts[pattern] + _join([
+                    platform,
+                    IOS_MOBILE_VERSIONS.index(mobile),
+                    IOS_WEBKIT_VERSIONS.index(webkit)
+                ] + token, self.ios_radices[pattern])
+                return self.android_size + index if self.render_ios(index) == ua else None
+        except (KeyError, ValueError, IndexError):
+            pass
+        return None
+    
+    def to_both(self, index, device_type):
+        """Map an index of one device type's space into the 'both' space"""
+        return self.android_size + index if device_type == 'ios' else index
+    
+    def shard_size(self, device_type='both', shard=(0, 1)):
+        """Number of user agents shard ``(k, N)`` can produce for a device type"""
+        k, n = shard
+        return sum(max(0, size - k + n - 1) // n for _, _, size, _ in self.strata(device_type))
+    
+    def iter_unique(self, count, device_type='both', seed=None, start=0, shard=(0, 1)):
+        """Yield ``count`` distinct user agents from a keyed permutation of the space"""
+        for index in self.iter_unique_indices(count, device_type, seed, start, shard):
+            yield self.render(index, device_type)
+    
+    def iter_unique_indices(self, count, device_type='both', seed=None, start=0, shard=(0, 1)):
+        """Indices behind iter_unique(), in the given device type's space"""
+        k, n = shard
+        if not 0 <= k < n:
+            raise ValueError(f"Invalid shard {k}/{n}: need 0 <= k < N")
+        available = self.shard_size(device_type, shard)
+        if start < 0 or start + count > available:
+            raise ValueError(
+                f"Requested {count} user agents from position {start}, "
+                f"but the {device_type} space only holds {available}"
+                + (f" for shard {k}/{n}" if n > 1 else "")
+            )
+        
+        # Each stratum is permuted on its own; the schedule interleaves them in the
+        # proportions normal generation produces, so unique output looks like it
+        strata = self.strata(device_type)
+        schedule = QuotaSchedule(
+            [max(0, size - k + n - 1) // n for _, _, size, _ in strata],
+            _quotas([weight for _, _, _, weight in strata])
+        )
+        permutations = [
+            FeistelPermutation(size, _derive_key(seed, f"{self.fingerprint}:{label}")) if size else None
+            for label, _, size, _ in strata
+        ]
+        for position in range(start, start + count):
+            stratum, offset = schedule.locate(position)
+            yield strata[stratum][1] + permutations[stratum][k + n * offset]
+
+
+class QuotaSchedule:
+    """Interleaves strata in proportion to integer quotas, dropping each one once it runs out."""
+    
+    def __init__(self, counts, quotas):
+        self.counts = tuple(counts)
+        self.quotas = tuple(quotas)
+        self.size = sum(self.counts)
+        # (first position, full-cycle length, period order, rank in period, stratum bases, tail)
+        self.phases = []
+        used = [0] * len(self.counts)
+        position = 0
+        active = [s for s, count in enumerate(self.counts) if count]
+        while active:
+            order = [active[i] for i in _interleave([self.quotas[s] for s in active])]
+            ranks = []
+            seen = {}
+            for s in order:
+                ranks.append(seen.get(s, 0))
+                seen[s] = ranks[-1] + 1
+            cycles = min((self.counts[s] - used[s]) // self.quotas[s] for s in active)
+            bases = dict((s, used[s]) for s in active)
+            for s in active:
+                used[s] += cycles * self.quotas[s]
+            # One partial period in which strata short of a full quota use up what they have left
+            tail = []
+            for s in order:
+                if used[s] < self.counts[s]:
+                    tail.append((s, used[s]))
+                    used[s] += 1
+            self.phases.append((position, cycles * len(order), order, ranks, bases, tail))
+            position += cycles * len(order) + len(tail)
+            active = [s for s in active if used[s] < self.counts[s]]
+        self._starts = [phase[0] for phase in self.phases]
+    
+    def locate(self, position):
+        """(stratum, position within the stratum) of a schedule position"""
+        if not 0 <= position < self.size:
+            raise IndexError("Schedule position out of range")
+        first, full, order, ranks, bases, tail = self.phases[bisect.bisect_right(self._starts, position) - 1]
+        offset = position - first
+        if offset >= full:
+            return tail[offset - full]
+        cycle, slot = divmod(offset, len(order))
+        stratum = order[slot]
+        return stratum, bases[stratum] + cycle * self.quotas[stratum] + ranks[slot]
+
+
+class HeaderHints:
+    """Client-hint header fragments precomputed for every catalog row."""
+    
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.android_models = tuple(f'"{model}"' for _, model, _ in catalog.android_devices)
+        platform_versions = {
+            version: '"' + '.'.join((version.split('.') + ['0', '0'])[:3]) + '"'
+            for version in {version for _, _, version in catalog.android_devices}
+        }
+        self.android_platform_versions = tuple(platform_versions[version] for _, _, version in catalog.android_devices)
+        self.chrome_brands = tuple(
+            {flavour: self._brand_list(brand, version) for flavour, brand in CH_UA_BRANDS.items()}
+            for version, _ in catalog.chrome_versions
+        )
+    
+    @staticmethod
+    def _brand_list(brand, version):
+        major = version.split('.')[0]
+        grease, grease_version = CH_UA_GREASE[int(major) % len(CH_UA_GREASE)] if major.isdigit() else CH_UA_GREASE[0]
+        return f'"{brand}";v="{major}", "Chromium";v="{major}", "{grease}";v="{grease_version}"'
+
+
+def version_key(version):
+    """Sortable tuple for a dotted version string ('17.2.1' -> (17, 2, 1))"""
+    return tuple(int(part) if part.isdigit() else 0 for part in version.split('.'))
+
+
+class CatalogFacets:
+    """Sorted row-index arrays per FILTER_FIELDS value over one catalog snapshot."""
+    
+    def __init__(self, catalog):
+        self.catalog = catalog
+        android = catalog.android_devices
+        ios = catalog.ios_devices
+        
+        manufacturers = {}
+        for row, (manufacturer, _, _) in enumerate(android):
+            manufacturers.setdefault(manufacturer.lower(), []).append(row)
+        self.android_manufacturers = {name: tuple(rows) for name, rows in manufacturers.items()}
+        self.android_tablets = tuple(
+            row for row, (_, model, _) in enumerate(android) if ANDROID_TABLET_PATTERN.search(model)
+        )
+        self.ios_tablets = tuple(row for row, (model, _) in enumerate(ios) if ios_device_type(model) == 'iPad')
+        self.android_phones = tuple(sorted(set(range(len(android))).difference(self.android_tablets)))
+        self.ios_phones = tuple(sorted(set(range(len(ios))).difference(self.ios_tablets)))
+        self.android_versions = self._by_version(version for _, _, version in android)
+        self.ios_versions = self._by_version(version for _, version in ios)
+        self.chrome_versions = self._by_prefix(version for version, _ in catalog.chrome_versions)
+        self.safari_versions = self._by_prefix(version for version, _ in catalog.safari_versions)
+    
+    @staticmethod
+    def _by_version(versions):
+        """(sorted version keys, row indices in the same order)"""
+        ordered = sorted((version_key(version), row) for row, version in enumerate(versions))
+        return [key for key, _ in ordered], tuple(row for _, row in ordered)
+    
+    @staticmethod
+    def _by_prefix(versions):
+        """{version prefix: sorted row indices}, for every whole-component prefix"""
+        prefixes = {}
+        for row, version in enumerate(versions):
+            parts = version.split('.')
+            for n in range(1, len(parts) + 1):
+                prefixes.setdefault('.'.join(parts[:n]), []).append(row)
+        return {prefix: tuple(rows) for prefix, rows in prefixes.items()}
+    
+    @staticmethod
+    def normalize(filters):
+        """Validate filters, returning them with empty values dropped and lists as tuples"""
+        if filters is None:
+            return {}
+        if not isinstance(filters, dict):
+            raise ValueError("Filters must be an object of facet values")
+        normalized = {}
+        for field, value in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter '{field}' (choose from {', '.join(FILTER_FIELDS)})")
+            if value is None or value == '' or value == [] or value == ():
+                continue
+            if field in ('manufacturer', 'chrome_version', 'safari_version'):
+                values = (value,) if isinstance(value, str) else value
+                if not isinstance(values, (list, tuple)) or not all(isinstance(v, str) and v for v in values):
+                    raise ValueError(f"'{field}' must be a string or a list of strings")
+                normalized[field] = tuple(values)
+            elif field == 'form_factor':
+                if value not in FORM_FACTORS:
+                    raise ValueError(f"'form_factor' must be one of {', '.join(FORM_FACTORS)}")
+                normalized[field] = value
+            else:
+                if not isinstance(value, str) or not re.fullmatch(r'\d+(?:\.\d+)*', value):
+                    raise ValueError(f"'{field}' must be a dotted version such as '17.2'")
+                normalized[field] = value
+        return normalized
+    
+    @staticmethod
+    def key(filters):
+        """Stable hash of normalized filters"""
+        canonical = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+    
+    def select(self, filters):
+        """Resolve normalized filters to {catalog table: row indices}"""
+        constraints = {}
+        
+        def restrict(table, rows):
+            constraints.setdefault(table, []).append(rows if isinstance(rows, tuple) else tuple(rows))
+        
+        manufacturers = filters.get('manufacturer')
+        if manufacturers is not None:
+            names = {name.lower() for name in manufacturers}
+            restrict('android_devices', itertools.chain.from_iterable(
+                self.android_manufacturers.get(name, ()) for name in names
+            ))
+            if 'apple' not in names:
+                restrict('ios_devices', ())
+        
+        form_factor = filters.get('form_factor')
+        if form_factor is not None:
+            for table, tablets, phones in (('android_devices', self.android_tablets, self.android_phones),
+                                           ('ios_devices', self.ios_tablets, self.ios_phones)):
+                restrict(table, tablets if form_factor == 'tablet' else phones)
+        
+        low = filters.get('min_os_version')
+        high = filters.get('max_os_version')
+        if low is not None or high is not None:
+            for table, (keys, rows) in (('android_devices', self.android_versions),
+                                        ('ios_devices', self.ios_versions)):
+                start = 0 if low is None else bisect.bisect_left(keys, version_key(low))
+                # Any version starting with the upper bound's components sorts below this
+                stop = len(keys) if high is None else bisect.bisect_right(keys, version_key(high) + (math.inf,))
+                restrict(table, rows[start:stop])
+        
+        for field, table, prefixes, other in (
+            ('chrome_version', 'chrome_versions', self.chrome_versions, 'ios_devices'),
+            ('safari_version', 'safari_versions', self.safari_versions, 'android_devices')
+        ):
+            versions = filters.get(field)
+            if versions is not None:
+                restrict(table, itertools.chain.from_iterable(prefixes.get(version, ()) for version in versions))
+                restrict(other, ())
+        
+        # A table with one constraint takes the precomputed array as is; several are intersected smallest first
+        subsets = {}
+        for table, arrays in constraints.items():
+            if len(arrays) == 1:
+                subsets[table] = arrays[0]
+                continue
+            arrays.sort(key=len)
+            rows = set(arrays[0])
+            for array in arrays[1:]:
+                rows.intersection_update(array)
+            subsets[table] = tuple(sorted(rows))
+        return subsets
+
+
+class CompatibilityIndex:
+    """Browser rows each device class of one catalog snapshot can be paired with."""
+    
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.android_classes, self.chrome_rows = self._classes(
+            (version for _, _, version in catalog.android_devices),
+            lambda version: tuple(
+                row for row, (chrome_version, _) in enumerate(catalog.chrome_versions)
+                if self.chrome_supports(version, chrome_version)
+            )
+        )
+        self.ios_classes, self.safari_rows = self._classes(
+            ((ios_device_type(model), version) for model, version in catalog.ios_devices),
+            lambda platform: self.shipped_safari(*platform, catalog.safari_versions)
+        )
+    
+    @staticmethod
+    def _classes(keys, compatible):
+        """(class id per device row, compatible browser rows per class)"""
+        ids = {}
+        rows = []
+        classes = []
+        for key in keys:
+            if key not in ids:
+                ids[key] = len(rows)
+                rows.append(compatible(key))
+            classes.append(ids[key])
+        return tuple(classes), tuple(rows)
+    
+    @staticmethod
+    def chrome_supports(android_version, chrome_version):
+        """Whether this Chrome version runs on this Android version"""
+        major = version_key(chrome_version)[0]
+        floor = next((floor for first, floor in CHROME_ANDROID_FLOORS if major >= first), None)
+        return floor is None or version_key(android_version) >= version_key(floor)
+    
+    @staticmethod
+    def shipped_safari(device_type, ios_version, safari_versions):
+        """Rows of ``safari_versions`` bundled with this device type and iOS version"""
+        ios = version_key(ios_version)
+        candidates = []
+        for row, (version, build) in enumerate(safari_versions):
+            safari = version_key(version)
+            ipad_build = len(build.split('.')) >= IPAD_SAFARI_BUILD_COMPONENTS
+            if safari[0] == ios[0] and safari <= ios and (device_type == 'iPad' or not ipad_build):
+                candidates.append((safari, ipad_build, row))
+        candidates = [c for c in candidates if c[0][:2] == ios[:2]] or candidates
+        if not candidates:
+            return ()
+        newest = max(safari for safari, _, _ in candidates)
+        candidates = [c for c in candidates if c[0] == newest]
+        if device_type == 'iPad' and any(ipad_build for _, ipad_build, _ in candidates):
+            candidates = [c for c in candidates if c[1]]
+        return tuple(row for _, _, row in candidates)
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) draws from a fixed discrete distribution."""
+    
+    __slots__ = ('size', 'prob', 'alias', 'values')
+    
+    def __init__(self, weights, values=None):
+        self.size = len(weights)
+        self.values = range(self.size) if values is None else values
+        total = float(sum(weights))
+        if not self.size or total <= 0:
+            raise ValueError("Need at least one positive weight")
+        
+        self.prob = [1.0] * self.size
+        if min(weights) == max(weights):
+            # Uniform: every column keeps its own value, so the O(n) pairing loop is skipped
+            self.alias = self.values
+            return
+        scaled = [weight * self.size / total for weight in weights]
+        self.alias = list(range(self.size))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        self.alias = [self.values[i] for i in self.alias]
+    
+    def sample(self, rng):
+        # One uniform draw picks the column (integer part) and the coin (fraction)
+        position = rng.random() * self.size
+        column = int(position)
+        return self.values[column] if position - column < self.prob[column] else self.alias[column]
+
+
+class CumulativeTable:
+    """Bisect draws over cumulative weights: O(log n) draws, but built in C-speed passes."""
+    
+    __slots__ = ('values', 'cum_weights')
+    
+    def __init__(self, weights, values):
+        self.values = values
+        self.cum_weights = list(itertools.accumulate(weights))
+        if not self.cum_weights or self.cum_weights[-1] <= 0:
+            raise ValueError("Need at least one positive weight")
+    
+    def sample(self, rng):
+        return self.values[bisect.bisect(self.cum_weights, rng.random() * self.cum_weights[-1])]
+
+
+class WeightProfile:
+    """A weight profile compiled into alias tables over one catalog snapshot."""
+    
+    def __init__(self, spec, hints, compat, subsets=None):
+        self.spec = self.validate(spec)
+        self.hints = hints
+        self.compat = compat
+        catalog = hints.catalog
+        weight = self._weigher
+        
+        manufacturers = spec.get('manufacturers', {})
+        android_versions = weight(spec.get('android_versions', {}))
+        ios_versions = weight(spec.get('ios_versions', {}))
+        chrome_versions = weight(spec.get('chrome_versions', {}))
+        safari_versions = weight(spec.get('safari_versions', {}))
+        templates = spec.get('templates', {})
+        
+        # Per-row weights, kept so restrict() can rebuild tables without weighing rows again
+        self.android_weights = [
+            manufacturers.get(manufacturer, 1) * android_versions(version)
+            for manufacturer, _, version in catalog.android_devices
+        ]
+        self.ios_weights = [ios_versions(version) for _, version in catalog.ios_devices]
+        self.chrome_weights = [chrome_versions(version) for version, _ in catalog.chrome_versions]
+        self.safari_weights = [safari_versions(version) for version, _ in catalog.safari_versions]
+        self.android_classes = compat.android_classes
+        self.ios_classes = compat.ios_classes
+        self.android_templates = self._table(
+            len(ANDROID_TEMPLATES), None, lambda i: templates.get(ANDROID_TEMPLATES[i], 1)
+        )
+        self.ios_templates = self._table(
+            len(IOS_TEMPLATES), None, lambda i: IOS_PATTERN_WEIGHTS[i] * templates.get(IOS_TEMPLATES[i], 1)
+        )
+        
+        # One browser table per compatibility class; devices whose class has none drop out
+        self.chrome_tables = self._class_tables(self.chrome_weights, compat.chrome_rows, None)
+        self.safari_tables = self._class_tables(self.safari_weights, compat.safari_rows, None)
+        self.android_devices = self._device_table(self.android_weights, self.android_classes, self.chrome_tables, None)
+        self.ios_devices = self._device_table(self.ios_weights, self.ios_classes, self.safari_tables, None)
+        # The one weight every row shares, or None: lets restrict() skip gathering weights
+        self.android_weight = self._shared_weight(self.android_weights)
+        self.ios_weight = self._shared_weight(self.ios_weights)
+        self._restrict(subsets or {})
+    
+    def restrict(self, subsets):
+        """Copy of this profile limited to ``subsets`` (from CatalogFacets.select), sharing unchanged tables"""
+        restricted = copy.copy(self)
+        restricted._restrict(subsets)
+        return restricted
+    
+    def _restrict(self, subsets):
+        # Only tables a subset touches are rebuilt, so the cost follows the rows kept, not the catalog
+        for devices, weights, shared, classes, tables, browsers, browser_weights, class_rows in (
+            ('android_devices', self.android_weights, self.android_weight, self.android_classes, 'chrome_tables',
+             'chrome_versions', self.chrome_weights, self.compat.chrome_rows),
+            ('ios_devices', self.ios_weights, self.ios_weight, self.ios_classes, 'safari_tables',
+             'safari_versions', self.safari_weights, self.compat.safari_rows)
+        ):
+            before = getattr(self, tables)
+            if browsers in subsets:
+                setattr(self, tables, self._class_tables(browser_weights, class_rows, subsets[browsers]))
+            after = getattr(self, tables)
+            classes_changed = [table is None for table in before] != [table is None for table in after]
+            if devices in subsets or classes_changed:
+                setattr(self, devices, self._device_table(weights, classes, after, subsets.get(devices), shared))
+        
+        self.device_types = tuple(
+            device_type for device_type, tables in (
+                ('android', (self.android_devices, self.android_templates)),
+                ('ios', (self.ios_devices, self.ios_templates))
+            )
+            if None not in tables
+        )
+        if not self.device_types:
+            raise ValueError("No user agents match this profile and filters")
+    
+    def check_device_type(self, device_type):
+        """Raise ValueError if this sampler cannot produce ``device_type``"""
+        if device_type != 'both' and device_type not in self.device_types:
+            raise ValueError(f"No {device_type} user agents match this profile and filters")
+    
+    def pick_device_type(self, device_type, rng):
+        """Resolve 'both' to a platform this sampler can produce (50/50 when both can)"""
+        if device_type == 'both':
+            if len(self.device_types) == 2:
+                return 'android' if rng.random() < 0.5 else 'ios'
+            return self.device_types[0]
+        self.check_device_type(device_type)
+        return device_type
+    
+    @staticmethod
+    def validate(spec):
+        """Check a profile definition, returning it unchanged"""
+        if not isinstance(spec, dict):
+            raise ValueError("A weight profile must be an object of weight tables")
+        for field, weights in spec.items():
+            if field not in PROFILE_FIELDS:
+                raise ValueError(f"Unknown profile field '{field}' (choose from {', '.join(PROFILE_FIELDS)})")
+            if not isinstance(weights, dict) or not all(
+                isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+                for value in weights.values()
+            ):
+                raise ValueError(f"'{field}' must map names to non-negative numbers")
+        unknown = set(spec.get('templates', {})) - set(ANDROID_TEMPLATES + IOS_TEMPLATES)
+        if unknown:
+            raise ValueError(f"Unknown template(s): {', '.join(sorted(unknown))}")
+        return spec
+    
+    @staticmethod
+    def key(spec):
+        """Stable hash of a profile definition (the compile cache key)"""
+        canonical = json.dumps(spec, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+    
+    @staticmethod
+    def _weigher(weights):
+        """Return version -> weight using longest whole-component prefix matching"""
+        cache = {}
+        
+        def weigh(version):
+            if version not in cache:
+                parts = version.split('.')
+                cache[version] = next(
+                    (weights['.'.join(parts[:n])] for n in range(len(parts), 0, -1) if '.'.join(parts[:n]) in weights),
+                    1
+                )
+            return cache[version]
+        
+        return weigh
+    
+    @staticmethod
+    def _table(size, subset, weigh):
+        """Alias table over rows ``0 .. size - 1`` (or just ``subset``); None if no weight is positive"""
+        weights = [weigh(index) for index in (range(size) if subset is None else subset)]
+        if sum(weights) <= 0:
+            return None
+        return AliasTable(weights, subset)
+    
+    @classmethod
+    def _device_table(cls, weights, classes, browser_tables, subset, shared=None):
+        """Table over device rows (or just ``subset``), leaving out classes without a browser table"""
+        rows = range(len(weights)) if subset is None else subset
+        if None in browser_tables:
+            rows = [row for row in rows if browser_tables[classes[row]] is not None]
+        if subset is None or not rows:
+            return cls._table(len(weights), rows, weights.__getitem__)
+        # Restricted tables are built per filter set: keep that to C-speed passes over the kept rows
+        if shared is not None:
+            return AliasTable([shared] * len(rows), rows) if shared > 0 else None
+        kept = [weights[rows[0]]] if len(rows) == 1 else operator.itemgetter(*rows)(weights)
+        return CumulativeTable(kept, rows) if any(kept) else None
+    
+    @staticmethod
+    def _shared_weight(weights):
+        return weights[0] if weights and min(weights) == max(weights) else None
+    
+    @classmethod
+    def _class_tables(cls, weights, class_rows, subset):
+        """Alias table per compatibility class over its browser rows (None where no weight is positive)"""
+        if subset is not None:
+            allowed = set(subset)
+            class_rows = [tuple(row for row in rows if row in allowed) for rows in class_rows]
+        return tuple(cls._table(len(weights), rows, weights.__getitem__) for rows in class_rows)
+
+
+class FeistelPermutation:
+    """Keyed bijection of ``range(size)`` onto itself (cycle-walked Feistel network)."""
+    
+    ROUNDS = 4
+    
+    def __init__(self, size, key):
+        if size <= 0:
+            raise ValueError("Permutation size must be positive")
+        self.size = size
+        self.key = key
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half_bits) - 1
+        self.byte_length = (self.half_bits + 7) // 8
+    
+    def _round(self, value, round_index):
+        digest = hashlib.blake2b(
+            value.to_bytes(self.byte_length, 'little') + bytes((round_index,)),
+            key=self.key,
+            digest_size=8
+        ).digest()
+        return int.from_bytes(digest, 'little') & self.mask
+    
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for round_index in range(self.ROUNDS):
+            left, right = right, left ^ self._round(right, round_index)
+        return (left << self.half_bits) | right
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError("Permutation position out of range")
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class DiskDedup:
+    """Hash-partitioned, on-disk set of strings for dedup jobs larger than RAM."""
+    
+    # Rough in-memory cost of one ~150 character string held in a set
+    BYTES_PER_ITEM = 256
+    MAX_PARTITIONS = 1000
+    
+    def __init__(self, expected_items, memory_budget, directory=None):
+        per_partition = max(1, memory_budget // self.BYTES_PER_ITEM)
+        self.partitions = max(1, math.ceil(expected_items / per_partition))
+        if self.partitions > self.MAX_PARTITIONS:
+            raise ValueError(
+                f"{expected_items} items need {self.partitions} partitions at this memory budget; "
+                f"raise the budget to at least {expected_items * self.BYTES_PER_ITEM // self.MAX_PARTITIONS} bytes"
+            )
+        self.directory = tempfile.mkdtemp(prefix='ua-dedup-', dir=directory)
+        # Buffer candidates and append them per flush, one run file open at a time,
+        # so the partition count never runs into the open file limit
+        self._flush_at = per_partition
+        self._buffered = 0
+        self._buffers = [[] for _ in range(self.partitions)]
+        self._runs = set()
+    
+    def _path(self, kind, partition):
+        return os.path.join(self.directory, f"{kind}-{partition}.txt")
+    
+    def add(self, item):
+        """Queue a candidate (newline-free string) for the next drain()"""
+        self._buffers[hash(item) % self.partitions].append(item + '\n')
+        self._buffered += 1
+        if self._buffered >= self._flush_at:
+            self._flush()
+    
+    def _flush(self):
+        """Append buffered candidates to their partitions' run files"""
+        for partition, buffer in enumerate(self._buffers):
+            if not buffer:
+                continue
+            with open(self._path('run', partition), 'a', encoding='utf-8', buffering=1 << 16) as run:
+                run.writelines(buffer)
+            buffer.clear()
+            self._runs.add(partition)
+        self._buffered = 0
+    
+    def drain(self, on_duplicate=None):
+        """Yield queued candidates not seen before, partition by partition"""
+        self._flush()
+        for partition in sorted(self._runs):
+            self._runs.discard(partition)
+            
+            accepted_path = self._path('accepted', partition)
+            seen = set()
+            if os.path.exists(accepted_path):
+                with open(accepted_path, encoding='utf-8') as f:
+                    seen.update(line.rstrip('\n') for line in f)
+            
+            run_path = self._path('run', partition)
+            with open(run_path, encoding='utf-8') as candidates, \
+                    open(accepted_path, 'a', encoding='utf-8', buffering=1 << 16) as accepted:
+                for line in candidates:
+                    item = line.rstrip('\n')
+                    if item in seen:
+                        if on_duplicate is not None:
+                            on_duplicate(item)
+                        continue
+                    seen.add(item)
+                    accepted.write(line)
+                    yield item
+            os.remove(run_path)
+    
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _product(values):
+    result = 1
+    for value in values:
+        result *= value
+    return result
+
+
+def _split(index, radices):
+    """Split a mixed-radix index into digits (most significant first)"""
+    digits = []
+    for radix in reversed(radices):
+        index, digit = divmod(index, radix)
+        digits.append(digit)
+    return digits[::-1]
+
+
+def _join(digits, radices):
+    """Combine mixed-radix digits (most significant first) into an index"""
+    index = 0
+    for digit, radix in zip(digits, radices):
+        if not 0 <= digit < radix:
+            raise ValueError(f"Digit {digit} out of range for radix {radix}")
+        index = index * radix + digit
+    return index
+
+
+def _quotas(weights):
+    """Smallest integers in the same proportions as ``weights`` (to 4 decimal places)"""
+    scaled = [round(weight * 10000) for weight in weights]
+    divisor = math.gcd(*scaled) or 1
+    return [value // divisor for value in scaled]
+
+
+def _interleave(quotas):
+    """One period of a smooth weighted round robin: each index ``i`` appears ``quotas[i]`` times"""
+    total = sum(quotas)
+    credit = [0] * len(quotas)
+    order = []
+    for _ in range(total):
+        for i, quota in enumerate(quotas):
+            credit[i] += quota
+        best = max(range(len(quotas)), key=credit.__getitem__)
+        credit[best] -= total
+        order.append(best)
+    return order
+
+
+def _unique(items):
+    """Deduplicate while keeping first-seen order"""
+    return list(dict.fromkeys(items))
+
+
+def _derive_key(seed, label):
+    """Derive a permutation key from a user seed (random when seed is None)"""
+    if seed is None:
+        return os.urandom(16)
+    return hashlib.blake2b(f"{seed}:{label}".encode(), digest_size=16).digest()
+
+